@@ -5,12 +5,16 @@ import re
 import time
 import random
 import os
+import sys
 import html
 
 # --- KONFIGURACJA ---
 START_ID = 1      
 END_ID = 10000       # Zwiększ ten zakres (np. do 5000)
 OUTPUT_FILE = 'margonem_maps_final.json'
+# Dziennik: jedna linia JSON na pobraną mapę, dopisywana na bieżąco (koszt zapisu stały na mapę).
+# Na końcu (albo: python _getmapbot.py --compact) scalany do OUTPUT_FILE i usuwany.
+JOURNAL_FILE = 'margonem_maps_final.journal.jsonl'
 
 BASE_URL_VIEW = 'https://www.margoworld.pl/world/view/'
 BASE_URL_FRAME = 'https://www.margoworld.pl/world-frame/'
@@ -20,17 +24,56 @@ HEADERS = {
 }
 
 def load_existing_db():
+    """Baza z OUTPUT_FILE plus mapy z dziennika (np. po przerwanym przebiegu)."""
+    data = {}
     if os.path.exists(OUTPUT_FILE):
         try:
             with open(OUTPUT_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+                data = json.load(f)
         except json.JSONDecodeError:
-            return {}
-    return {}
+            data = {}
+    replayed = replay_journal(data)
+    if replayed:
+        print(f"Odtworzono z dziennika {replayed} map ({JOURNAL_FILE}).")
+    return data
+
+def replay_journal(data):
+    """Nakłada wpisy z dziennika na data. Uszkodzona (np. urwana przy awarii) linia jest pomijana."""
+    if not os.path.exists(JOURNAL_FILE):
+        return 0
+    count = 0
+    with open(JOURNAL_FILE, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                data[str(record["id"])] = record["map"]
+                count += 1
+            except (ValueError, KeyError, TypeError):
+                continue
+    return count
+
+def append_journal(journal, map_id, map_data):
+    """Dopisuje jedną mapę do otwartego dziennika (linia JSON) i wypycha ją na dysk."""
+    journal.write(json.dumps({"id": str(map_id), "map": map_data}, ensure_ascii=False) + "\n")
+    journal.flush()
 
 def save_db(data):
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
+    """Zapis atomowy: plik tymczasowy + os.replace – przerwany zapis nie psuje OUTPUT_FILE."""
+    tmp = OUTPUT_FILE + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, OUTPUT_FILE)
+
+def compact_journal(data=None):
+    """Scala dziennik z OUTPUT_FILE (jeden atomowy zapis) i usuwa dziennik."""
+    if data is None:
+        data = load_existing_db()
+    save_db(data)
+    if os.path.exists(JOURNAL_FILE):
+        os.remove(JOURNAL_FILE)
+    return data
 
 def extract_map_id(href):
     if not href: return None
@@ -87,6 +130,17 @@ def scrape_maps():
     maps_db = load_existing_db()
     print(f"Rozpoczynam pobieranie (Filtrowanie błędów) do pliku: {OUTPUT_FILE}")
 
+    journal = open(JOURNAL_FILE, 'a', encoding='utf-8')
+    try:
+        scrape_range(maps_db, journal)
+    finally:
+        journal.close()
+        # także po Ctrl+C / błędzie – to, co pobrano, trafia do OUTPUT_FILE
+        compact_journal(maps_db)
+
+    print(f"\nZakończono! Czysta baza zapisana w: {OUTPUT_FILE}")
+
+def scrape_range(maps_db, journal):
     for map_id in range(START_ID, END_ID + 1):
         str_map_id = str(map_id)
 
@@ -145,8 +199,8 @@ def scrape_maps():
                 "npcs": npcs
             }
 
-            # Zapis do pliku
-            save_db(maps_db)
+            # Zapis do dziennika (cały plik – dopiero przy scaleniu)
+            append_journal(journal, str_map_id, maps_db[str_map_id])
             
             # Statystyki w konsoli
             total_npcs = sum(n['count'] for n in npcs)
@@ -157,7 +211,9 @@ def scrape_maps():
         except Exception as e:
             print(f"[ERROR] ID {map_id}: {e}")
 
-    print(f"\nZakończono! Czysta baza zapisana w: {OUTPUT_FILE}")
-
 if __name__ == "__main__":
-    scrape_maps()
\ No newline at end of file
+    if "--compact" in sys.argv[1:]:
+        compact_journal()
+        print(f"Dziennik scalony do: {OUTPUT_FILE}")
+    else:
+        scrape_maps()
\ No newline at end of file
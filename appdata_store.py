@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Słownik trwały w pliku JSON w katalogu AppData – wspólny magazyn dla travel_times (czasy przejść)
+i gateway_cache (bramy map). Plik ma postać {"version": N, <section>: {...}}; wczytywany przy
+pierwszym użyciu, zapisywany atomowo (plik tymczasowy + os.replace). Uszkodzony albo brakujący
+plik to pusty słownik. Schemat wpisów należy do modułu, który magazyn tworzy. Przy częstych
+zmianach save_later(delay) zbiera je w jeden zapis (timer; reszta – flush() lub wyjście z procesu).
+Użycie:
+    store = AppDataStore("plik.json", "entries")
+    with store.lock:
+        entries = store.data()
+        entries[key] = value
+        store.save()
+"""
+import atexit
+import json
+import os
+import threading
+
+from config_credentials import _get_appdata_path
+
+
+class AppDataStore:
+    """Jeden plik JSON w AppData; data(), save() i save_later() wywołuje się pod lock."""
+
+    def __init__(self, filename, section, version=1):
+        self.filename = filename
+        self.section = section
+        self.version = version
+        self.lock = threading.Lock()
+        self._data = None
+        self._dirty = False
+        self._timer = None
+        self._atexit = False
+
+    def path(self):
+        """Pełna ścieżka do pliku magazynu."""
+        return os.path.join(_get_appdata_path(), self.filename)
+
+    def data(self):
+        """Słownik sekcji (wczytany przy pierwszym użyciu); zmiany utrwala save()."""
+        if self._data is not None:
+            return self._data
+        self._data = {}
+        try:
+            with open(self.path(), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            section = data.get(self.section) if isinstance(data, dict) else None
+            if isinstance(section, dict):
+                self._data = section
+        except (OSError, ValueError):
+            pass
+        return self._data
+
+    def save(self):
+        """Zapis atomowy całej sekcji."""
+        self._dirty = False
+        path = self.path()
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"version": self.version, self.section: self.data()}, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def save_later(self, delay):
+        """Oznacza zmiany do zapisu; jeden zapis najpóźniej po delay s (zamiast save() po każdej zmianie)."""
+        self._dirty = True
+        if not self._atexit:
+            atexit.register(self.flush)
+            self._atexit = True
+        if self._timer is None:
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Zapis odłożonych zmian (bez blokady – bierze ją sam)."""
+        with self.lock:
+            timer, self._timer = self._timer, None
+            if self._dirty:
+                self.save()
+        if timer is not None and timer is not threading.current_thread():
+            timer.cancel()
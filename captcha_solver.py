@@ -11,6 +11,8 @@ Wszystkie sprawdzenia w default_content (zagadka jest w głównym dokumencie).
 import re
 import time
 
+from game_context import mark_default_content
+
 
 MIN_TRIES_TO_SOLVE = 2  # jeśli pozostałe próby < 2, nie rozwiązuj – zostaw grę
 
@@ -32,6 +34,7 @@ CHAR_TO_SELECT = "*"
 def _switch_default(driver):
     try:
         driver.switch_to.default_content()
+        mark_default_content(driver)
     except Exception:
         pass
 
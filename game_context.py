@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 """
 Kontekst gry – przełączanie na iframe z Engine, sprawdzanie czy silnik jest gotowy.
+Stan kontekstu jest zapamiętywany per driver: po udanym sprawdzeniu kolejne wywołania
+nie odpytują przeglądarki, dopóki kontekst nie zostanie unieważniony (błąd skryptu,
+przełączenie ramki).
 """
-# (brak zewnętrznych zależności)
+import threading
+import weakref
 
 
 def is_engine_ready(driver):
@@ -15,25 +19,136 @@ def is_engine_ready(driver):
         return False
 
 
-def ensure_game_context(driver):
+def _locate_game_frame(driver):
     """
-    Przełącza na kontekst, w którym działa Engine (główna strona lub iframe z grą).
-    Zwraca True jeśli Engine jest gotowy po przełączeniu.
+    Szuka kontekstu z Engine: najpierw bieżący, potem kolejne iframe głównej strony.
+    Zwraca (True, indeks_iframe | None) gdy znaleziono (None = główny dokument), inaczej (False, None).
     """
     if is_engine_ready(driver):
-        return True
+        return True, None
     try:
+        driver.switch_to.default_content()
+        if is_engine_ready(driver):
+            return True, None
         frames = driver.find_elements("tag name", "iframe")
-        for _ in frames:
-            driver.switch_to.default_content()
-            for i, _ in enumerate(frames):
-                try:
-                    driver.switch_to.frame(i)
-                    if is_engine_ready(driver):
-                        return True
-                except Exception:
-                    pass
+        for i in range(len(frames)):
+            try:
+                driver.switch_to.default_content()
+                driver.switch_to.frame(i)
+                if is_engine_ready(driver):
+                    return True, i
+            except Exception:
+                pass
         driver.switch_to.default_content()
     except Exception:
         pass
-    return False
+    return False, None
+
+
+def ensure_game_context(driver):
+    """
+    Przełącza na kontekst, w którym działa Engine (główna strona lub iframe z grą).
+    Zwraca True jeśli Engine jest gotowy po przełączeniu.
+    Zawsze sprawdza przeglądarkę – na gorącej ścieżce używaj ensure_game_context_cached.
+    """
+    ok, _frame = _locate_game_frame(driver)
+    return ok
+
+
+class GameContextState:
+    """
+    Zapamiętany stan kontekstu gry dla jednego drivera.
+    valid – bieżąca ramka ma gotowy Engine; frame_index – iframe, w którym go znaleziono;
+    in_default – ktoś przełączył driver na default_content (wystarczy wrócić do frame_index).
+    Liczniki: hits (bez odpytywania), probes (pełne szukanie ramki), reprobes (szukanie po
+    unieważnieniu ważnego kontekstu), reentries (powrót do znanej ramki bez sprawdzania),
+    invalidations.
+    """
+
+    def __init__(self):
+        self.valid = False
+        self.frame_index = None
+        self.in_default = False
+        self.ever_valid = False
+        self.hits = 0
+        self.probes = 0
+        self.reprobes = 0
+        self.reentries = 0
+        self.invalidations = 0
+        self.lock = threading.RLock()
+
+    def stats(self):
+        return {
+            "valid": self.valid,
+            "hits": self.hits,
+            "probes": self.probes,
+            "reprobes": self.reprobes,
+            "reentries": self.reentries,
+            "invalidations": self.invalidations,
+        }
+
+
+_states = weakref.WeakKeyDictionary()
+_states_lock = threading.Lock()
+
+
+def get_context_state(driver):
+    """Wspólny (dla wszystkich instancji MargonemAPI) stan kontekstu danego drivera."""
+    with _states_lock:
+        state = _states.get(driver)
+        if state is None:
+            state = GameContextState()
+            _states[driver] = state
+        return state
+
+
+def ensure_game_context_cached(driver):
+    """
+    Jak ensure_game_context, ale bez odpytywania przeglądarki, gdy kontekst jest ważny.
+    Po przełączeniu na default_content (mark_default_content) wraca do znanej ramki jednym
+    switch_to.frame; pełne szukanie ramki tylko po invalidate_game_context.
+    """
+    state = get_context_state(driver)
+    with state.lock:
+        if state.valid:
+            state.hits += 1
+            return True
+        if state.in_default and state.ever_valid:
+            try:
+                if state.frame_index is not None:
+                    driver.switch_to.frame(state.frame_index)
+                state.in_default = False
+                state.valid = True
+                state.reentries += 1
+                return True
+            except Exception:
+                pass
+        if state.ever_valid:
+            state.reprobes += 1
+        state.probes += 1
+        ok, frame_index = _locate_game_frame(driver)
+        state.valid = bool(ok)
+        state.in_default = False
+        if ok:
+            state.frame_index = frame_index
+            state.ever_valid = True
+        return state.valid
+
+
+def invalidate_game_context(driver):
+    """Unieważnia kontekst (np. po JavascriptException / NoSuchFrameException) – następne ensure szuka ramki od nowa."""
+    state = get_context_state(driver)
+    with state.lock:
+        state.valid = False
+        state.in_default = False
+        state.invalidations += 1
+
+
+def mark_default_content(driver):
+    """Zapamiętuje, że driver został przełączony na default_content – następne ensure wróci do ramki gry."""
+    state = get_context_state(driver)
+    with state.lock:
+        if state.valid:
+            state.invalidations += 1
+        state.valid = False
+        state.in_default = True
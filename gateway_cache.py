@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Współrzędne bram i rozmiary map poznane w grze, zapisywane w katalogu AppData (gateways.json).
+Bramy mapy nie zmieniają się w trakcie sesji, więc po pierwszej wizycie na mapie nawigacja
+bierze pozycję bramy stąd – bez migawki i szukania bramy na liście przy każdym przejściu.
+Po aktualizacji gry pozycja może być nieaktualna: MargonemAPI odświeża wtedy wpis z migawki.
+maps_graph wczytuje te dane jako geometrię map dla plan_route.
+"""
+import time
+
+from appdata_store import AppDataStore
+
+GATEWAYS_FILENAME = "gateways.json"
+
+# map_id (str) -> {"gateways": {gateway_id (str): [x, y]}, "size": [x, y] | None, "t": time}
+_store = AppDataStore(GATEWAYS_FILENAME, "maps")
+
+
+def remember_gateways(map_id, gateways, size_x=None, size_y=None):
+    """
+    Zapamiętuje bramy mapy (lista {id, x, y} z migawki / MargonemAPI.get_gateways) i jej rozmiar.
+    Plik jest zapisywany tylko gdy coś się zmieniło. Zwraca True przy zmianie.
+    """
+    if map_id is None:
+        return False
+    coords = {}
+    for g in gateways or []:
+        gid = g.get("id")
+        if gid is not None and g.get("x") is not None and g.get("y") is not None:
+            coords[str(gid)] = [int(g["x"]), int(g["y"])]
+    size = [int(size_x), int(size_y)] if size_x and size_y else None
+    with _store.lock:
+        maps = _store.data()
+        entry = maps.get(str(map_id))
+        if entry is not None:
+            merged = dict(entry.get("gateways") or {})
+            merged.update(coords)
+            new_size = size or entry.get("size")
+            if merged == entry.get("gateways") and new_size == entry.get("size"):
+                return False
+            coords, size = merged, new_size
+        if not coords and size is None:
+            return False
+        maps[str(map_id)] = {"gateways": coords, "size": size, "t": time.time()}
+        _store.save()
+        return True
+
+
+def get_gateway_pos(map_id, gateway_id):
+    """Zapamiętana pozycja (x, y) bramy gateway_id na mapie map_id lub None."""
+    if map_id is None or gateway_id is None:
+        return None
+    with _store.lock:
+        entry = _store.data().get(str(map_id))
+        pos = (entry.get("gateways") or {}).get(str(gateway_id)) if entry else None
+    return (pos[0], pos[1]) if pos else None
+
+
+def has_map(map_id):
+    """Czy bramy mapy map_id są już znane."""
+    with _store.lock:
+        return map_id is not None and str(map_id) in _store.data()
+
+
+def known_maps():
+    """Kopia danych: map_id -> ({gateway_id: (x, y)}, (size_x, size_y) | None)."""
+    with _store.lock:
+        return {
+            mid: (
+                {gid: (pos[0], pos[1]) for gid, pos in (entry.get("gateways") or {}).items()},
+                tuple(entry["size"]) if entry.get("size") else None,
+            )
+            for mid, entry in _store.data().items()
+        }
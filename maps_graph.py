@@ -1,20 +1,208 @@
 # -*- coding: utf-8 -*-
 """
-Graf map Margonem z pliku margonem_maps_final.json.
-BFS do wyznaczania ścieżki między mapami, wyszukiwanie po nazwie.
+Graf map Margonem z pliku margonem_maps_final.json (skompilowany do cache obok pliku).
+BFS i trasy o najmniejszym czasie między mapami, wyszukiwanie map i NPC po nazwie.
 """
+import hashlib
+import heapq
 import json
 import os
-from collections import deque
+import pickle
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from gateway_cache import known_maps
+from travel_times import learned_legs, travel_generation
 
 # Ścieżka do pliku względem tego modułu
 _DIR = os.path.dirname(os.path.abspath(__file__))
 MAPS_JSON_PATH = os.path.join(_DIR, "margonem_maps_final.json")
+MAPS_CACHE_PATH = os.path.join(_DIR, "margonem_maps_final.cache")
+MAPS_OVERLAY_PATH = os.path.join(_DIR, "margonem_maps_overlay.json")
+
+# Wersja układu cache – zmiana wymusza przebudowę starych plików.
+CACHE_FORMAT = 6
+
+# Ile pól odległości (dist + parent dla jednej mapy startowej) trzyma LRU.
+DISTANCE_CACHE_SIZE = 64
+
+# Model czasu przejścia dla plan_route: prędkość chodu (kratki/s), czas zmiany mapy (s),
+# droga przez mapę bez znanych współrzędnych bram i rozmiaru (kratki).
+WALK_TILES_PER_SEC = 4.0
+MAP_CHANGE_SEC = 2.0
+DEFAULT_MAP_WALK_TILES = 30
+
+# find_hunting_grounds: ocena = liczba potworów / (czas dojścia + HUNT_TRAVEL_OFFSET_SEC) –
+# stała, żeby bieżąca mapa (czas 0) nie wygrywała zawsze i żeby bliskie mapy nie dominowały.
+HUNT_TRAVEL_OFFSET_SEC = 30.0
+
+# Co ile sekund watch_maps() sprawdza mtime / rozmiar pliku map.
+MAPS_WATCH_INTERVAL_SEC = 5.0
+
+# observe_gateways: wyjście z pliku jest uznawane za martwe dopiero, gdy nie było go w grze
+# przy tylu osobnych wizytach na mapie (pojedyncza lista bram bywa niepełna).
+DEAD_GATEWAY_MISSES = 2
+
+_db = None  # graf z nakładką (używany przez wszystkie zapytania)
+_base_db = None  # graf z pliku map – punkt odniesienia dla nakładki
+_load_lock = threading.Lock()
+_reload_lock = threading.Lock()
+_warm_thread = None
+_loaded_stamp = None  # mtime_ns / rozmiar pliku map, z którego zbudowano _base_db
+_watch_thread = None
+_watch_stop = None
+
+# Nakładka: map_id -> {"added": [gateway_id, ...], "dead": [gateway_id, ...], "t": time}
+_overlay = None
+_overlay_lock = threading.Lock()
+
+# Geometria map poznana w grze: map_id -> {"size": (x, y) | None, "gateways": {gateway_id: (x, y)}}.
+# Wpisy nie są zmieniane w miejscu, tylko podmieniane – kopia słownika (_LegCosts) jest spójna.
+_geometry = {}
+_geometry_lock = threading.Lock()
+_geometry_generation = 0  # rośnie przy każdej zmianie _geometry
+
+
+# Litery, które nie rozkładają się w NFKD na literę bazową + znak diakrytyczny.
+_FOLD_EXTRA = str.maketrans({"ł": "l", "Ł": "l", "đ": "d", "Đ": "d", "ø": "o", "Ø": "o", "ß": "ss"})
+
+
+def fold_text(text):
+    """Tekst do porównań: małe litery, bez znaków diakrytycznych (ł -> l, ó -> o)."""
+    text = unicodedata.normalize("NFKD", (text or "").translate(_FOLD_EXTRA).lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+class _TextIndex:
+    """
+    Indeks podciągów dla listy tekstów (już po fold_text): n-gram (1–3 znaki) -> rosnąca
+    tablica numerów tekstów. Zapytanie do 3 znaków to jeden odczyt; dłuższe – najrzadszy
+    trigram zapytania i sprawdzenie kandydatów.
+    """
+
+    def __init__(self, texts, grams=None):
+        self.texts = texts
+        if grams is None:
+            grams = {}
+            for i, t in enumerate(texts):
+                seen = set()
+                for n in (1, 2, 3):
+                    for k in range(len(t) - n + 1):
+                        seen.add(t[k:k + n])
+                for g in seen:
+                    posting = grams.get(g)
+                    if posting is None:
+                        posting = grams[g] = array("i")
+                    posting.append(i)
+        self.grams = grams
+
+    def search(self, query):
+        """Numery tekstów zawierających query (po fold_text), rosnąco."""
+        if len(query) <= 3:
+            return self.grams.get(query, ())
+        postings = []
+        for k in range(len(query) - 2):
+            p = self.grams.get(query[k:k + 3])
+            if p is None:
+                return []
+            postings.append(p)
+        texts = self.texts
+        return [i for i in min(postings, key=len) if query in texts[i]]
+
+
+class NpcGroup:
+    """Grupa NPC na mapie: nazwa, poziom i liczność (wpis z npcs w JSON, bez adresu obrazka)."""
+
+    __slots__ = ("name", "level", "count")
+
+    def __init__(self, name, level, count):
+        self.name = name
+        self.level = level
+        self.count = count
+
+    def __repr__(self):
+        return "NpcGroup({!r}, {}, {})".format(self.name, self.level, self.count)
+
+
+class _NpcData:
+    """
+    Dane NPC grafu (osobna sekcja cache, wczytywana leniwie).
+    display[k] – nazwa NPC k (internowana); text – indeks n-gramów nazw po fold_text;
+    maps[k] – krotka (indeks_mapy, suma count) dla NPC k.
+    Tabela poziomów: wszystkie grupy posortowane po level – lv_level[r], lv_map[r], lv_count[r], lv_npc[r].
+    Grupy mapy i w kolejności z JSON: wiersze tabeli rows[offsets[i]:offsets[i + 1]].
+    """
+
+    __slots__ = ("display", "text", "maps", "lv_level", "lv_map", "lv_count", "lv_npc", "offsets", "rows")
+
+    def __init__(self, display, texts, grams, maps, lv_level, lv_map, lv_count, lv_npc, offsets, rows):
+        self.display = [sys.intern(name) for name in display]
+        self.text = _TextIndex(texts, grams)
+        self.maps = maps
+        self.lv_level = lv_level
+        self.lv_map = lv_map
+        self.lv_count = lv_count
+        self.lv_npc = lv_npc
+        self.offsets = offsets
+        self.rows = rows
+
+    @classmethod
+    def build(cls, npcs):
+        """Z list grup per mapa: npcs[i] – [(nazwa, level, count), ...] mapy i."""
+        names = {}  # nazwa -> k
+        display = []
+        totals = []  # k -> {indeks_mapy: suma count}
+        entries = []  # (level, indeks_mapy, count, k) w kolejności JSON
+        offsets = array("i", [0])
+        for i, groups in enumerate(npcs):
+            for nname, level, count in groups:
+                k = names.get(nname)
+                if k is None:
+                    k = names[nname] = len(display)
+                    display.append(nname)
+                    totals.append({})
+                totals[k][i] = totals[k].get(i, 0) + count
+                entries.append((level, i, count, k))
+            offsets.append(len(entries))
+        order = sorted(range(len(entries)), key=entries.__getitem__)
+        rows = array("i", [0]) * len(entries)  # wpis (kolejność JSON) -> wiersz tabeli poziomów
+        for r, j in enumerate(order):
+            rows[j] = r
+        return cls(
+            display,
+            [fold_text(name) for name in display],
+            None,
+            [tuple(sorted(t.items())) for t in totals],
+            array("i", [entries[j][0] for j in order]),
+            array("i", [entries[j][1] for j in order]),
+            array("i", [entries[j][2] for j in order]),
+            array("i", [entries[j][3] for j in order]),
+            offsets,
+            rows,
+        )
+
+    def payload(self):
+        return (
+            self.display, self.text.texts, self.text.grams, self.maps,
+            self.lv_level, self.lv_map, self.lv_count, self.lv_npc, self.offsets, self.rows,
+        )
+
+    def in_levels(self, level_min, level_max):
+        """Zakres wierszy tabeli poziomów z level w [level_min, level_max] (bisect po lv_level)."""
+        return range(bisect_left(self.lv_level, level_min), bisect_right(self.lv_level, level_max))
 
-_maps_data = None
-_graph = None
-_name_to_ids = None
-_all_names_sorted = None
+    def groups(self, i):
+        """Grupy NPC mapy i jako rekordy NpcGroup."""
+        display, lv_level, lv_count, lv_npc = self.display, self.lv_level, self.lv_count, self.lv_npc
+        return [
+            NpcGroup(display[lv_npc[r]], lv_level[r], lv_count[r])
+            for r in self.rows[self.offsets[i]:self.offsets[i + 1]]
+        ]
 
 
 def _normalize_id(mid):
@@ -24,94 +212,778 @@ def _normalize_id(mid):
     return str(int(mid)) if isinstance(mid, (int, float)) else str(mid)
 
 
+class _MapsDB:
+    """
+    Skompilowany graf map. Mapa i jest opisana przez:
+    ids[i] – ID (string, kolejność jak w JSON), names[i] – nazwa ("" gdy brak).
+    npc – _NpcData; gdy graf jest z cache, wczytywane przy pierwszym użyciu przez npc_loader().
+    Krawędzie w CSR: wyjścia mapy i to e w range(offsets[i], offsets[i + 1]),
+    targets[e] – indeks mapy docelowej, gateways[e] – ID bramy (liczba; gw_str – gdy ID nie są liczbami).
+    gateway_xy – współrzędne bram z pliku (jeśli są), name_collisions – [(nazwa, [ID, ...]), ...].
+    index: ID -> i; name_to_ids: nazwa (lower) -> [ID, ...]; all_names_sorted – do list w GUI.
+    """
+
+    def __init__(self, ids, names, offsets, targets, gateways, gateway_xy=None, derived=None, npc=None, npc_loader=None):
+        self.ids = ids
+        self.names = names
+        self.offsets = offsets
+        self.targets = targets
+        self.gateways = gateways
+        self.gw_str = isinstance(gateways, list)
+        self._npc = npc
+        self._npc_loader = npc_loader
+        self._npc_lock = threading.Lock()
+        self.gateway_xy = gateway_xy or {}
+        self.n = len(ids)
+        self.index = {mid: i for i, mid in enumerate(ids)}
+        self.name_to_ids = {}
+        for mid, name in zip(ids, names):
+            if name:
+                self.name_to_ids.setdefault(name.lower(), []).append(mid)
+        # nazwy noszone przez kilka map (piętra lochów, domy) – krawędzie i tak idą po ID
+        self.name_collisions = sorted(
+            (self.names[self.index[mids[0]]], list(mids))
+            for mids in self.name_to_ids.values() if len(mids) > 1
+        )
+        self.all_names_sorted = sorted(name for name in names if name)
+        # derived – indeksy wyszukiwania i składowe z cache (None: liczone teraz)
+        derived = derived or {}
+        self._build_search(derived.get("search"))
+        if derived.get("scc") is not None:
+            self.comp, self.comp_size, self.reach = derived["scc"]
+        else:
+            self._build_scc()
+        # LRU pól BFS: indeks startu -> (dist, parent); żyje tyle co ten graf (przeładowanie = nowy obiekt)
+        self._fields = OrderedDict()
+        self._fields_lock = threading.Lock()
+        self.field_hits = 0
+        self.field_misses = 0
+
+    def _build_scc(self):
+        """
+        Silnie spójne składowe (Tarjan, iteracyjnie): comp[i] – numer składowej mapy i.
+        Tarjan numeruje składowe w odwrotnej kolejności topologicznej (najpierw ujścia), więc
+        osiągalność w grafie składowych liczy się jednym przebiegiem: reach[c] – bitset składowych
+        osiągalnych z c (razem z c).
+        """
+        n = self.n
+        offsets, targets = self.offsets, self.targets
+        comp = array("i", [-1]) * n
+        low = array("i", [0]) * n
+        order = array("i", [-1]) * n  # numer odwiedzenia (-1 = nieodwiedzony)
+        on_stack = bytearray(n)
+        stack = []
+        counter = 0
+        ncomp = 0
+        for root in range(n):
+            if order[root] >= 0:
+                continue
+            work = [(root, offsets[root])]
+            order[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            while work:
+                u, e = work[-1]
+                if e < offsets[u + 1]:
+                    work[-1] = (u, e + 1)
+                    v = targets[e]
+                    if order[v] < 0:
+                        order[v] = low[v] = counter
+                        counter += 1
+                        stack.append(v)
+                        on_stack[v] = 1
+                        work.append((v, offsets[v]))
+                    elif on_stack[v] and order[v] < low[u]:
+                        low[u] = order[v]
+                    continue
+                work.pop()
+                if work:
+                    p = work[-1][0]
+                    if low[u] < low[p]:
+                        low[p] = low[u]
+                if low[u] == order[u]:
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = 0
+                        comp[w] = ncomp
+                        if w == u:
+                            break
+                    ncomp += 1
+        members = [0] * ncomp
+        for c in comp:
+            members[c] += 1
+        reach = [0] * ncomp
+        succ = [set() for _ in range(ncomp)]
+        for u in range(n):
+            cu = comp[u]
+            for v in targets[offsets[u]:offsets[u + 1]]:
+                if comp[v] != cu:
+                    succ[cu].add(comp[v])
+        for c in range(ncomp):  # ujścia mają najmniejsze numery
+            bits = 1 << c
+            for d in succ[c]:
+                bits |= reach[d]
+            reach[c] = bits
+        self.comp = comp
+        self.comp_size = members
+        self.reach = reach
+
+    @property
+    def npc(self):
+        """Dane NPC (_NpcData) – przy pierwszym odwołaniu wczytywane z cache."""
+        data = self._npc
+        if data is None:
+            with self._npc_lock:
+                if self._npc is None:
+                    self._npc = self._npc_loader()
+                    self._npc_loader = None
+                data = self._npc
+        return data
+
+    @property
+    def npc_loaded(self):
+        return self._npc is not None
+
+    def reachable(self, u, v):
+        """Czy z mapy u (indeks) da się dojść do mapy v – O(1) na bitsetach składowych."""
+        return bool((self.reach[self.comp[u]] >> self.comp[v]) & 1)
+
+    def _build_search(self, search):
+        """
+        Indeks nazw map (z cache albo liczony): map_text – nazwy po fold_text;
+        name_rank[i] – pozycja mapy i w kolejności nazw (name.lower()), do sortowania wyników.
+        """
+        if search is not None:
+            map_texts, map_grams, self.name_rank = search
+            self.map_text = _TextIndex(map_texts, map_grams)
+            return
+        self.map_text = _TextIndex([fold_text(name) for name in self.names])
+        self.name_rank = array("i", [0]) * self.n
+        for r, i in enumerate(sorted(range(self.n), key=lambda i: self.names[i].lower())):
+            self.name_rank[i] = r
+
+    def payload(self):
+        """Sekcja topologii zapisywana w cache (dane NPC – osobno, self.npc.payload())."""
+        derived = {
+            "search": (self.map_text.texts, self.map_text.grams, self.name_rank),
+            "scc": (self.comp, self.comp_size, self.reach),
+        }
+        return (self.ids, self.names, self.offsets, self.targets, self.gateways, self.gateway_xy, derived)
+
+    def gateway_id(self, e):
+        """ID bramy krawędzi e jako string (jak klucz exits w JSON)."""
+        gw = self.gateways[e]
+        return gw if self.gw_str else str(gw)
+
+    def edges(self, mid):
+        """Krawędzie mapy mid: [(gateway_id, target_map_id), ...]."""
+        i = self.index[mid]
+        ids, targets = self.ids, self.targets
+        return [(self.gateway_id(e), ids[targets[e]]) for e in range(self.offsets[i], self.offsets[i + 1])]
+
+    def bfs(self, start):
+        """
+        BFS po indeksach od start (poziomami, maska odwiedzin w bytearray). Zwraca (dist, parent):
+        dist[i] – liczba przejść (-1 gdy nieosiągalna), parent[i] – poprzednia mapa na najkrótszej
+        ścieżce (-1 dla start / nieosiągalnych). Zawsze pełne pole – trafia do LRU (field()).
+        """
+        n = self.n
+        offsets, targets = self.offsets, self.targets
+        visited = bytearray(n)
+        dist = array("i", [-1]) * n
+        parent = array("i", [-1]) * n
+        visited[start] = 1
+        dist[start] = 0
+        frontier = [start]
+        d = 0
+        while frontier:
+            d += 1
+            nxt = []
+            for u in frontier:
+                for v in targets[offsets[u]:offsets[u + 1]]:
+                    if not visited[v]:
+                        visited[v] = 1
+                        parent[v] = u
+                        nxt.append(v)
+            for v in nxt:
+                dist[v] = d
+            frontier = nxt
+        return dist, parent
+
+    def field(self, start):
+        """(dist, parent) pełnego BFS od start – z LRU albo liczone i zapamiętane."""
+        with self._fields_lock:
+            f = self._fields.get(start)
+            if f is not None:
+                self._fields.move_to_end(start)
+                self.field_hits += 1
+                return f
+            self.field_misses += 1
+        f = self.bfs(start)
+        with self._fields_lock:
+            self._fields[start] = f
+            self._fields.move_to_end(start)
+            while len(self._fields) > DISTANCE_CACHE_SIZE:
+                self._fields.popitem(last=False)
+        return f
+
+    def field_stats(self):
+        with self._fields_lock:
+            total = self.field_hits + self.field_misses
+            return {
+                "hits": self.field_hits,
+                "misses": self.field_misses,
+                "size": len(self._fields),
+                "hit_rate": (self.field_hits / float(total)) if total else 0.0,
+            }
+
+    def edge_between(self, u, v):
+        """Pierwsza krawędź u -> v (jak w kolejności exits) lub -1."""
+        targets = self.targets
+        for e in range(self.offsets[u], self.offsets[u + 1]):
+            if targets[e] == v:
+                return e
+        return -1
+
+    def path_edges(self, parent, start, target):
+        """Krawędzie od start do target odtworzone z parent (lista indeksów e) lub None."""
+        edges = []
+        node = target
+        while node != start:
+            prev = parent[node]
+            if prev < 0:
+                return None
+            edges.append(self.edge_between(prev, node))
+            node = prev
+        edges.reverse()
+        return edges
+
+    def path_of_edges(self, edges):
+        """Lista (gateway_id, target_map_id) dla listy krawędzi."""
+        return [(self.gateway_id(e), self.ids[self.targets[e]]) for e in edges]
+
+    def rewired(self, changes):
+        """
+        Nowy graf z podmienionymi wyjściami map: changes – {i: [(indeks_celu, gateway_id), ...]}.
+        Mapy, nazwy, indeksy wyszukiwania i dane NPC są współdzielone; składowe liczone od nowa.
+        Z LRU przechodzą pola, w których żadna zmieniona mapa nie była osiągalna (wynik się nie zmienia).
+        """
+        offsets = array("i", [0])
+        targets = array("i")
+        gateways = []
+        for i in range(self.n):
+            if i in changes:
+                for j, gw in changes[i]:
+                    targets.append(j)
+                    gateways.append(gw)
+            else:
+                for e in range(self.offsets[i], self.offsets[i + 1]):
+                    targets.append(self.targets[e])
+                    gateways.append(self.gateways[e])
+            offsets.append(len(targets))
+        db = _MapsDB(
+            self.ids, self.names, offsets, targets, _pack_gateways(gateways), self.gateway_xy,
+            derived={"search": (self.map_text.texts, self.map_text.grams, self.name_rank)},
+            npc=self._npc, npc_loader=self._npc_loader,
+        )
+        with self._fields_lock:
+            for start, f in self._fields.items():
+                if all(f[0][i] < 0 for i in changes):
+                    db._fields[start] = f
+        return db
+
+
+def _exit_name_and_pos(value):
+    """Wartość z exits: nazwa (string) albo {name, x, y} – zwraca (nazwa, (x, y) | None)."""
+    if isinstance(value, dict):
+        pos = None
+        if value.get("x") is not None and value.get("y") is not None:
+            pos = (int(value["x"]), int(value["y"]))
+        return (value.get("name") or "").strip(), pos
+    return (value or "").strip(), None
+
+
+def _compile(maps_data):
+    """
+    Buduje _MapsDB z surowego JSON (dict map_id -> {name, exits, npcs}).
+    Klucz w exits to ID mapy docelowej (i zarazem ID bramy w grze) – krawędź idzie po ID.
+    Po nazwie rozwiązywane są tylko wyjścia do map spoza pliku i tylko gdy nazwa jest jednoznaczna.
+    """
+    ids = list(maps_data.keys())
+    index = {mid: i for i, mid in enumerate(ids)}
+    names = [(info.get("name") or "").strip() for info in maps_data.values()]
+    by_name = {}  # name (lower) -> [indeksy map]
+    for i, name in enumerate(names):
+        if name:
+            by_name.setdefault(name.lower(), []).append(i)
+    offsets = array("i", [0])
+    targets = array("i")
+    gateways = []
+    gateway_xy = {}  # map_id -> {gateway_id: (x, y)} – gdy plik zna współrzędne bram
+    npcs = []
+    for mid, info in maps_data.items():
+        for gw_id, value in (info.get("exits") or {}).items():
+            target_name, pos = _exit_name_and_pos(value)
+            j = index.get(_normalize_id(gw_id))
+            if j is None:
+                candidates = by_name.get(target_name.lower()) if target_name else None
+                if not candidates or len(candidates) != 1:
+                    continue
+                j = candidates[0]
+            targets.append(j)
+            gateways.append(gw_id)
+            if pos is not None:
+                gateway_xy.setdefault(mid, {})[_normalize_id(gw_id)] = pos
+        offsets.append(len(targets))
+        npcs.append([
+            ((n.get("name") or "").strip(), int(n.get("level") or 0), int(n.get("count") or 0))
+            for n in (info.get("npcs") or [])
+        ])
+    return _MapsDB(ids, names, offsets, targets, _pack_gateways(gateways), gateway_xy, npc=_NpcData.build(npcs))
+
+
+def _pack_gateways(gateways):
+    """ID bram to w praktyce liczby (ID map docelowych) – w tablicy array("q"), gdy się da; inaczej stringi."""
+    try:
+        if all(str(int(gw)) == str(gw) for gw in gateways):
+            return array("q", [int(gw) for gw in gateways])
+    except (TypeError, ValueError):
+        pass
+    return [str(gw) for gw in gateways]
+
+
+def _file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _json_stamp(path):
+    st = os.stat(path)
+    return {"mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+
+def _write_cache_bytes(cache_path, header, body):
+    """Zapis atomowy: nagłówek (pickle), za nim body – sekcje topologii i NPC."""
+    tmp = cache_path + ".tmp"
+    try:
+        with open(tmp, "wb") as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.write(body)
+        os.replace(tmp, cache_path)
+    except Exception:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def _write_cache(cache_path, header, db):
+    """header["npc_at"] – przesunięcie sekcji NPC względem końca nagłówka."""
+    topology = pickle.dumps(db.payload(), protocol=pickle.HIGHEST_PROTOCOL)
+    npc = pickle.dumps(db.npc.payload(), protocol=pickle.HIGHEST_PROTOCOL)
+    header = dict(header, npc_at=len(topology))
+    _write_cache_bytes(cache_path, header, topology + npc)
+
+
+def _read_cache_header(f):
+    header = pickle.load(f)
+    if not isinstance(header, dict) or header.get("format") != CACHE_FORMAT or "npc_at" not in header:
+        return None
+    return header
+
+
+def _npc_loader(json_path, cache_path, sha1, ids):
+    """
+    Funkcja wczytująca sekcję NPC grafu z cache (gdy cache nadal opisuje ten sam JSON – sha1),
+    a w razie problemu – z JSON (o ile mapy się nie zmieniły; inaczej pusty zestaw NPC).
+    """
+    def load():
+        try:
+            with open(cache_path, "rb") as f:
+                header = _read_cache_header(f)
+                if header is not None and header.get("sha1") == sha1:
+                    f.seek(f.tell() + header["npc_at"])
+                    return _NpcData(*pickle.load(f))
+        except (OSError, EOFError, pickle.UnpicklingError, TypeError, ValueError, AttributeError):
+            pass
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                db = _compile(json.load(f))
+            if db.ids == ids:
+                return db.npc
+        except (OSError, ValueError):
+            pass
+        return _NpcData.build([[] for _ in ids])
+
+    return load
+
+
+def load_compiled(json_path=None, cache_path=None):
+    """
+    Zwraca _MapsDB dla json_path: z cache gdy aktualny, inaczej parsuje JSON i zapisuje cache.
+    Cache jest aktualny gdy zgadza się mtime i rozmiar JSON; przy niezgodności porównywany
+    jest jeszcze skrót sha1 (np. plik tylko dotknięty) – wtedy odświeżany jest sam nagłówek.
+    Z cache wczytywana jest tylko topologia; dane NPC – przy pierwszym użyciu (_MapsDB.npc).
+    """
+    json_path = json_path or MAPS_JSON_PATH
+    cache_path = cache_path or MAPS_CACHE_PATH
+    stamp = _json_stamp(json_path)
+    sha1 = None
+    try:
+        topology = None
+        body = None  # przy dotkniętym JSON – całe body do przepisania z nowym nagłówkiem
+        with open(cache_path, "rb") as f:
+            header = _read_cache_header(f)
+            if header is not None:
+                fresh = header.get("mtime_ns") == stamp["mtime_ns"] and header.get("size") == stamp["size"]
+                touched = False
+                if not fresh and header.get("size") == stamp["size"]:
+                    sha1 = _file_sha1(json_path)
+                    fresh = touched = header.get("sha1") == sha1
+                if fresh:
+                    body_at = f.tell()
+                    topology = pickle.load(f)
+                    if touched:
+                        f.seek(body_at)
+                        body = f.read()
+        if topology is not None:
+            # plik cache zamknięty – na Windows os.replace otwartego pliku się nie uda
+            if body is not None:
+                header.update(stamp)
+                _write_cache_bytes(cache_path, header, body)
+            loader = _npc_loader(json_path, cache_path, header.get("sha1"), topology[0])
+            return _MapsDB(*topology, npc_loader=loader)
+    except (OSError, EOFError, pickle.UnpicklingError, TypeError, ValueError, AttributeError):
+        pass
+    with open(json_path, "r", encoding="utf-8") as f:
+        db = _compile(json.load(f))
+    header = {"format": CACHE_FORMAT, "sha1": sha1 or _file_sha1(json_path)}
+    header.update(stamp)
+    _write_cache(cache_path, header, db)
+    return db
+
+
 def _load_maps():
-    global _maps_data, _graph, _name_to_ids, _all_names_sorted
-    if _maps_data is not None:
-        return
-    with open(MAPS_JSON_PATH, "r", encoding="utf-8") as f:
-        _maps_data = json.load(f)
-    # name (lower) -> list of map_ids (first used when resolving exit target)
-    _name_to_ids = {}
-    for mid, info in _maps_data.items():
-        name = (info.get("name") or "").strip()
-        if not name:
+    """Skompilowany graf z nakładką (wczytywany raz – z cache albo z JSON)."""
+    global _db, _base_db, _loaded_stamp
+    db = _db
+    if db is not None:
+        return db
+    with _load_lock:
+        if _db is None:
+            stamp = _json_stamp(MAPS_JSON_PATH)
+            _base_db = load_compiled()
+            _db = _apply_overlay(_base_db)
+            _seed_geometry(_db)
+            _loaded_stamp = stamp
+        return _db
+
+
+def _deep_size(obj):
+    """Przybliżony rozmiar (bajty) struktur grafu: kontenery, tablice, stringi, obiekty z __dict__ / __slots__."""
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, (type(threading.Lock()), OrderedDict)) or callable(o):
             continue
-        key = name.lower()
-        if key not in _name_to_ids:
-            _name_to_ids[key] = []
-        _name_to_ids[key].append(mid)
-    # graph: map_id -> [(gateway_id, target_map_id), ...]
-    # gateway_id w JSON to string (klucz w exits), target to nazwa - szukamy id po nazwie
-    _graph = {}
-    for mid, info in _maps_data.items():
-        exits = info.get("exits") or {}
-        edges = []
-        for gw_id, target_name in exits.items():
-            target_name = (target_name or "").strip()
-            if not target_name:
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        elif hasattr(o, "__slots__"):
+            stack.extend(getattr(o, name) for name in o.__slots__ if hasattr(o, name))
+        elif hasattr(o, "__dict__"):
+            stack.append(o.__dict__)
+    return total
+
+
+def reload_maps():
+    """
+    Buduje graf od nowa z pliku map (cache, indeksy, nakładka) i podmienia go atomowo.
+    Budowa idzie poza _load_lock – zapytania w tym czasie korzystają ze starego grafu, a że każde
+    bierze jedną referencję (_load_maps()), widzi stary albo nowy graf w całości, nigdy mieszankę.
+    LRU odległości startuje pusty (należy do grafu). Zwraca dict: sec, maps_before, maps_after,
+    size_before, size_after (bajty – szacunek _deep_size struktur grafu).
+    """
+    global _db, _base_db, _loaded_stamp
+    with _reload_lock:
+        old = _db
+        size_before = _deep_size(old) if old is not None else 0
+        started = time.time()
+        stamp = _json_stamp(MAPS_JSON_PATH)
+        base = load_compiled()
+        with _load_lock:
+            # nakładka nakładana pod blokadą – observe_gateways w trakcie budowy nie przepadnie
+            db = _apply_overlay(base)
+            _seed_geometry(db)
+            _base_db, _db, _loaded_stamp = base, db, stamp
+        sec = time.time() - started
+        return {
+            "sec": sec,
+            "maps_before": old.n if old is not None else 0,
+            "maps_after": db.n,
+            "size_before": size_before,
+            "size_after": _deep_size(db),
+        }
+
+
+def watch_maps(log_callback=None, interval=MAPS_WATCH_INTERVAL_SEC):
+    """
+    Uruchamia (raz) wątek w tle, który co interval sekund sprawdza mtime i rozmiar pliku map.
+    Po zmianie czeka, aż dwa kolejne odczyty będą jednakowe (plik zapisany do końca),
+    i wywołuje reload_maps(); czas i zmianę pamięci przekazuje do log_callback.
+    Plik, którego nie da się wczytać, jest pomijany do następnej zmiany.
+    """
+    global _watch_thread, _watch_stop
+    if _watch_thread is not None and _watch_thread.is_alive():
+        return
+    stop = threading.Event()
+
+    def log(msg):
+        if log_callback:
+            try:
+                log_callback(msg)
+            except Exception:
+                pass
+
+    def work():
+        pending = None
+        failed = None
+        while not stop.wait(interval):
+            try:
+                stamp = _json_stamp(MAPS_JSON_PATH)
+            except OSError:
+                continue  # plik w trakcie podmiany
+            if _loaded_stamp is None or stamp == _loaded_stamp or stamp == failed:
+                pending = None
+                continue
+            if stamp != pending:
+                pending = stamp
                 continue
-            key = target_name.lower()
-            candidates = _name_to_ids.get(key)
-            if candidates:
-                # bierzemy pierwszą mapę o danej nazwie
-                target_id = candidates[0]
-                edges.append((gw_id, target_id))
-        _graph[mid] = edges
-    _all_names_sorted = sorted(
-        (info.get("name") or "").strip()
-        for info in _maps_data.values()
-        if (info.get("name") or "").strip()
-    )
+            pending = None
+            try:
+                r = reload_maps()
+            except Exception as e:
+                failed = stamp
+                log("Mapy: nie udało się przeładować pliku map ({}), zostaje poprzedni graf.".format(e))
+                continue
+            failed = None
+            mb = 1024.0 * 1024.0
+            log("Mapy przeładowane: {} -> {} map w {:.2f} s, graf ~{:.1f} MB ({:+.1f} MB).".format(
+                r["maps_before"], r["maps_after"], r["sec"],
+                r["size_after"] / mb, (r["size_after"] - r["size_before"]) / mb))
+
+    _watch_stop = stop
+    _watch_thread = threading.Thread(target=work, daemon=True)
+    _watch_thread.start()
+
+
+def stop_watching_maps():
+    """Zatrzymuje wątek watch_maps()."""
+    global _watch_thread
+    if _watch_stop is not None:
+        _watch_stop.set()
+    _watch_thread = None
+
+
+def _get_overlay():
+    """Nakładka z pliku (wczytywana przy pierwszym użyciu, wywoływane pod _overlay_lock)."""
+    global _overlay
+    if _overlay is None:
+        _overlay = {}
+        try:
+            with open(MAPS_OVERLAY_PATH, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            maps = data.get("maps") if isinstance(data, dict) else None
+            if isinstance(maps, dict):
+                _overlay = maps
+        except (OSError, ValueError):
+            pass
+    return _overlay
+
+
+def _save_overlay():
+    """Zapis atomowy nakładki (wywoływane pod _overlay_lock)."""
+    tmp = MAPS_OVERLAY_PATH + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "maps": _overlay}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, MAPS_OVERLAY_PATH)
+    except OSError:
+        pass
+
+
+def _overlay_edges(base, i, entry):
+    """Wyjścia mapy i z pliku bez martwych, plus dodane: [(indeks_celu, gateway_id), ...]."""
+    dead = set(entry.get("dead") or ()) if entry else set()
+    edges = []
+    for e in range(base.offsets[i], base.offsets[i + 1]):
+        gw = base.gateway_id(e)
+        if gw not in dead:
+            edges.append((base.targets[e], gw))
+    for gw in (entry.get("added") or ()) if entry else ():
+        j = base.index.get(gw)
+        if j is not None:
+            edges.append((j, gw))
+    return edges
+
+
+def _apply_overlay(base):
+    """Graf base z nałożonymi poprawkami z pliku nakładki (base, gdy nakładka pusta)."""
+    with _overlay_lock:
+        overlay = dict(_get_overlay())
+    changes = {}
+    for mid, entry in overlay.items():
+        i = base.index.get(mid)
+        if i is not None and isinstance(entry, dict):
+            changes[i] = _overlay_edges(base, i, entry)
+    return base.rewired(changes) if changes else base
+
+
+def observe_gateways(map_id, gateways, visit=None):
+    """
+    Uzgadnia bramy widziane w grze na mapie map_id (lista {id, x, y}) z wyjściami z pliku map:
+    bramy do znanych map, których brak w pliku – dodane krawędzie (od razu); wyjścia z pliku,
+    których w grze nie ma – martwe (pomijane przy planowaniu), ale dopiero po DEAD_GATEWAY_MISSES
+    osobnych wizytach bez nich. visit – identyfikator bieżącej wizyty na mapie (kilka wywołań
+    w jednej wizycie liczy się raz); bez niego braki nie są liczone. Brama znów widoczna
+    przestaje być martwa. Różnice i liczniki braków trafiają do pliku nakładki, a przy zmianie
+    krawędzi graf jest przebudowywany dla tej jednej mapy.
+    Pusta lista bram (mapa się jeszcze wczytuje) jest ignorowana.
+    Zwraca (dodane, martwe) – listy ID bram – gdy zmieniły się krawędzie, inaczej None.
+    """
+    global _db
+    mid = _normalize_id(map_id)
+    observed = []
+    for g in gateways or []:
+        gid = _normalize_id(g.get("id"))
+        if gid is not None and gid not in observed:
+            observed.append(gid)
+    if mid is None or not observed:
+        return None
+    _load_maps()
+    with _load_lock:
+        base = _base_db
+        i = base.index.get(mid)
+        if i is None:
+            return None
+        known = [base.gateway_id(e) for e in range(base.offsets[i], base.offsets[i + 1])]
+        with _overlay_lock:
+            overlay = _get_overlay()
+            old = overlay.get(mid) or {}
+            old_misses = old.get("miss") or {}
+            misses = {}
+            dead = []
+            for gw in known:
+                if gw in observed:
+                    continue
+                count, seen_in = (old_misses.get(gw) or [0, None])[:2]
+                if visit is not None and seen_in != visit:
+                    count, seen_in = count + 1, visit
+                if count:
+                    misses[gw] = [count, seen_in]
+                if gw in (old.get("dead") or ()) or count >= DEAD_GATEWAY_MISSES:
+                    dead.append(gw)
+            added = [gw for gw in observed if gw not in known and gw in base.index]
+            edges_changed = (added, dead) != (old.get("added") or [], old.get("dead") or [])
+            if not edges_changed and misses == old_misses:
+                return None
+            if added or dead or misses:
+                overlay[mid] = {"added": added, "dead": dead, "miss": misses, "t": time.time()}
+            else:
+                overlay.pop(mid, None)
+            _save_overlay()
+        if not edges_changed:
+            return None
+        entry = {"added": added, "dead": dead}
+        _db = _db.rewired({i: _overlay_edges(base, i, entry)})
+    return added, dead
+
+
+def overlay_stats():
+    """Nakładka: liczba poprawionych map, dodanych krawędzi i martwych wyjść."""
+    with _overlay_lock:
+        overlay = _get_overlay()
+        return {
+            "maps": len(overlay),
+            "added": sum(len(e.get("added") or ()) for e in overlay.values()),
+            "dead": sum(len(e.get("dead") or ()) for e in overlay.values()),
+        }
+
+
+def warm_up():
+    """
+    Wczytuje graf map w wątku w tle (np. gdy startuje przeglądarka), żeby pierwsze
+    wywołanie z GUI / procesu nie czekało na parsowanie JSON. Bezpieczne do wielokrotnego wywołania.
+    """
+    global _warm_thread
+    if _db is not None or (_warm_thread is not None and _warm_thread.is_alive()):
+        return
+
+    def work():
+        try:
+            _load_maps()
+        except Exception:
+            pass
+
+    _warm_thread = threading.Thread(target=work, daemon=True)
+    _warm_thread.start()
 
 
 def get_all_map_names():
     """Zwraca posortowaną listę wszystkich nazw map (do listy / filtra)."""
-    _load_maps()
-    return list(_all_names_sorted)
+    db = _load_maps()
+    return list(db.all_names_sorted)
 
 
 def find_map_ids_by_name(name_substring):
     """
-    Zwraca listę par (map_id, name) map, których nazwa zawiera name_substring (bez rozróżniania wielkości).
+    Zwraca listę par (map_id, name) map, których nazwa zawiera name_substring
+    (bez rozróżniania wielkości liter i znaków diakrytycznych).
     """
-    _load_maps()
-    part = (name_substring or "").strip().lower()
+    db = _load_maps()
+    part = fold_text((name_substring or "").strip())
+    ids, names = db.ids, db.names
     if not part:
-        return [(mid, _maps_data[mid].get("name") or mid) for mid in sorted(_maps_data.keys(), key=lambda x: (_maps_data[x].get("name") or "").lower())]
-    out = []
-    for mid, info in _maps_data.items():
-        name = (info.get("name") or "").strip()
-        if part in name.lower():
-            out.append((mid, name))
-    return sorted(out, key=lambda x: x[1].lower())
+        return [(ids[i], names[i] or ids[i]) for i in sorted(range(db.n), key=db.name_rank.__getitem__)]
+    return [(ids[i], names[i]) for i in sorted(db.map_text.search(part), key=db.name_rank.__getitem__)]
 
 
 def get_map_id_by_name(name):
     """
     Zwraca map_id (string) dla pierwszej mapy o podanej nazwie (bez rozróżniania wielkości), lub None.
     """
-    _load_maps()
+    db = _load_maps()
     name = (name or "").strip()
     if not name:
         return None
     key = name.lower()
-    ids = _name_to_ids.get(key)
+    ids = db.name_to_ids.get(key)
     if ids:
         return ids[0]
-    # dopasowanie częściowe: pierwsza mapa zawierająca name
-    for mid, info in _maps_data.items():
-        if name.lower() in ((info.get("name") or "").lower()):
-            return mid
+    # dopasowanie częściowe: pierwsza mapa zawierająca name (indeks zwraca numery rosnąco)
+    for i in db.map_text.search(fold_text(name)):
+        return db.ids[i]
     return None
 
 
 def get_map_name_by_id(map_id):
     """Zwraca nazwę mapy o danym ID lub None."""
-    _load_maps()
+    db = _load_maps()
     mid = _normalize_id(map_id)
-    if mid not in _maps_data:
+    i = db.index.get(mid)
+    if i is None:
         return None
-    return (_maps_data[mid].get("name") or "").strip() or mid
+    return db.names[i] or mid
 
 
 def bfs_path(start_map_id, target_map_id):
@@ -120,37 +992,18 @@ def bfs_path(start_map_id, target_map_id):
     Zwraca listę krotek (gateway_id, target_map_id) – kolejne przejścia bramą na następną mapę.
     Pusta lista jeśli start == target. None jeśli brak ścieżki.
     """
-    _load_maps()
-    start = _normalize_id(start_map_id)
-    target = _normalize_id(target_map_id)
-    if start not in _graph or target not in _maps_data:
+    db = _load_maps()
+    start = db.index.get(_normalize_id(start_map_id))
+    target = db.index.get(_normalize_id(target_map_id))
+    if start is None or target is None:
         return None
     if start == target:
         return []
-    # BFS
-    queue = deque([start])
-    visited = {start}
-    parent = {}  # map_id -> (prev_map_id, gateway_id)
-    parent[start] = (None, None)
-    while queue:
-        current = queue.popleft()
-        for gw_id, next_id in _graph.get(current, []):
-            if next_id in visited:
-                continue
-            visited.add(next_id)
-            parent[next_id] = (current, gw_id)
-            if next_id == target:
-                # Odtwórz ścieżkę
-                path = []
-                node = target
-                while node != start:
-                    prev, gw = parent[node]
-                    path.append((gw, node))
-                    node = prev
-                path.reverse()
-                return path
-            queue.append(next_id)
-    return None
+    if not db.reachable(start, target):
+        return None
+    _dist, parent = db.field(start)
+    edges = db.path_edges(parent, start, target)
+    return None if edges is None else db.path_of_edges(edges)
 
 
 def bfs_distances(start_map_id):
@@ -158,57 +1011,502 @@ def bfs_distances(start_map_id):
     BFS od start_map_id: zwraca dict map_id -> odległość (liczba przejść).
     Tylko mapy osiągalne z start.
     """
-    _load_maps()
-    start = _normalize_id(start_map_id)
-    if start not in _graph:
+    db = _load_maps()
+    start = db.index.get(_normalize_id(start_map_id))
+    if start is None:
+        return {}
+    dist, _parent = db.field(start)
+    ids = db.ids
+    return {ids[i]: d for i, d in enumerate(dist) if d >= 0}
+
+
+def is_reachable(start_map_id, target_map_id):
+    """Czy z mapy start_map_id da się dojść do target_map_id (bez przeszukiwania grafu)."""
+    db = _load_maps()
+    start = db.index.get(_normalize_id(start_map_id))
+    target = db.index.get(_normalize_id(target_map_id))
+    if start is None or target is None:
+        return False
+    return db.reachable(start, target)
+
+
+def graph_report():
+    """
+    Podsumowanie spójności grafu map: dict z kluczami
+    maps, components (liczba silnie spójnych składowych), largest_component (liczba map),
+    one_way_exits [(map_id, gateway_id, target_map_id), ...] – wyjścia bez drogi powrotnej,
+    isolated_maps [map_id, ...] – mapy bez żadnych przejść (ani wejść, ani wyjść),
+    name_collisions [(nazwa, [map_id, ...]), ...] – nazwy noszone przez kilka map,
+    overlay – overlay_stats() (poprawki z bram widzianych w grze).
+    """
+    db = _load_maps()
+    offsets, targets, comp = db.offsets, db.targets, db.comp
+    has_in = bytearray(db.n)
+    one_way = []
+    for u in range(db.n):
+        for e in range(offsets[u], offsets[u + 1]):
+            v = targets[e]
+            has_in[v] = 1
+            # krawędź między różnymi składowymi – z v nie da się wrócić do u
+            if comp[u] != comp[v]:
+                one_way.append((db.ids[u], db.gateway_id(e), db.ids[v]))
+    isolated = [
+        db.ids[i] for i in range(db.n)
+        if not has_in[i] and offsets[i] == offsets[i + 1]
+    ]
+    return {
+        "maps": db.n,
+        "components": len(db.comp_size),
+        "largest_component": max(db.comp_size) if db.comp_size else 0,
+        "one_way_exits": one_way,
+        "isolated_maps": isolated,
+        "name_collisions": list(db.name_collisions),
+        "overlay": overlay_stats(),
+    }
+
+
+def distance_cache_stats():
+    """Statystyki LRU pól odległości: hits, misses, size, hit_rate (dla aktualnie wczytanego grafu)."""
+    return _load_maps().field_stats()
+
+
+def _seed_geometry(db):
+    """
+    Współrzędne bram z poprzednich sesji (gateway_cache) i z pliku map – bez nadpisywania
+    tych poznanych w grze w bieżącej sesji.
+    """
+    global _geometry_generation
+    try:
+        remembered = known_maps()
+    except Exception:
+        remembered = {}
+    with _geometry_lock:
+        for mid, (coords, size) in remembered.items():
+            geo = _geometry.get(mid) or {"size": None, "gateways": {}}
+            merged = dict(coords)
+            merged.update(geo["gateways"])
+            _geometry[mid] = {"size": geo["size"] or size, "gateways": merged}
+        for mid, coords in db.gateway_xy.items():
+            geo = _geometry.get(mid) or {"size": None, "gateways": {}}
+            merged = dict(coords)
+            merged.update(geo["gateways"])
+            _geometry[mid] = {"size": geo["size"], "gateways": merged}
+        _geometry_generation += 1
+
+
+def record_map_geometry(map_id, gateways, size_x=None, size_y=None):
+    """
+    Zapamiętuje współrzędne bram mapy (lista {id, x, y} z MargonemAPI.get_gateways / migawki)
+    i jej rozmiar – używane przez plan_route jako koszt przejścia przez mapę.
+    """
+    global _geometry_generation
+    mid = _normalize_id(map_id)
+    if mid is None:
+        return
+    coords = {}
+    for g in gateways or []:
+        gid = g.get("id")
+        if gid is not None and g.get("x") is not None and g.get("y") is not None:
+            coords[_normalize_id(gid)] = (int(g["x"]), int(g["y"]))
+    with _geometry_lock:
+        geo = _geometry.get(mid) or {"size": None, "gateways": {}}
+        merged = dict(geo["gateways"])
+        merged.update(coords)
+        size = (int(size_x), int(size_y)) if size_x and size_y else geo["size"]
+        if merged == geo["gateways"] and size == geo["size"] and mid in _geometry:
+            return
+        _geometry[mid] = {"size": size, "gateways": merged}
+        _geometry_generation += 1
+
+
+def _plan_generation():
+    """Stan danych, od których zależą czasy tras: (pomiary travel_times, geometria map)."""
+    return travel_generation(), _geometry_generation
+
+
+class _LegCosts:
+    """
+    Koszty przejść map dla jednego planu: kopia wyuczonych czasów (travel_times) i geometrii
+    brane raz, więc przeszukiwanie nie bierze blokad na każdej krawędzi. Koszty wyjść mapy
+    przy danej bramie wejściowej (exits) są pamiętane – kolejne przeszukiwania na tym samym
+    grafie (wiersze TourPlanner) liczą je tylko raz.
+    """
+
+    def __init__(self):
+        self._exits = {}  # (indeks mapy poprzedniej, indeks mapy) -> [(krawędź, s), ...]
+        try:
+            self._learned = learned_legs()
+        except Exception:
+            self._learned = {}
+        with _geometry_lock:
+            self._geometry = dict(_geometry)
+
+    def gateway_pos(self, map_id, gateway_id):
+        geo = self._geometry.get(map_id)
+        return geo["gateways"].get(gateway_id) if geo else None
+
+    def walk_tiles(self, map_id, from_pos, to_gateway_id):
+        """
+        Szacowana droga (kratki) na mapie map_id od from_pos (x, y) do bramy to_gateway_id.
+        Bez współrzędnych – średnia odległość na mapie o znanym rozmiarze, inaczej DEFAULT_MAP_WALK_TILES.
+        """
+        geo = self._geometry.get(map_id)
+        if geo is None:
+            return DEFAULT_MAP_WALK_TILES
+        exit_pos = geo["gateways"].get(to_gateway_id)
+        if from_pos is not None and exit_pos is not None:
+            return abs(exit_pos[0] - from_pos[0]) + abs(exit_pos[1] - from_pos[1])
+        size = geo["size"]
+        if size is not None:
+            # średnia odległość Manhattan dwóch losowych punktów prostokąta
+            return (size[0] + size[1]) / 3.0
+        return DEFAULT_MAP_WALK_TILES
+
+    def leg_sec(self, map_id, entry_gateway_id, entry_pos, exit_gateway_id):
+        """
+        Czas (s) przejścia mapy map_id od bramy wejściowej (pozycji entry_pos) do bramy wyjściowej
+        razem ze zmianą mapy: wyuczony (travel_times), a bez pomiarów – szacunek z geometrii.
+        """
+        learned = self._learned.get(map_id)
+        if learned:
+            sec = learned.get((entry_gateway_id, exit_gateway_id))
+            if sec is not None:
+                return sec
+        return self.walk_tiles(map_id, entry_pos, exit_gateway_id) / WALK_TILES_PER_SEC + MAP_CHANGE_SEC
+
+    def exits(self, db, u, v):
+        """Krawędzie wyjścia z mapy v (indeks) z czasem przejścia, gdy weszliśmy na nią z mapy u."""
+        out = self._exits.get((u, v))
+        if out is None:
+            map_id, entry_gw = db.ids[v], db.ids[u]
+            entry_pos = self.gateway_pos(map_id, entry_gw)
+            out = [
+                (f, self.leg_sec(map_id, entry_gw, entry_pos, db.gateway_id(f)))
+                for f in range(db.offsets[v], db.offsets[v + 1])
+            ]
+            self._exits[(u, v)] = out
+        return out
+
+
+def _route_search(db, start, start_pos, target=-1, goals=None, costs=None):
+    """
+    Dijkstra po krawędziach od mapy start (koszt kroku zależy od bramy, którą weszliśmy na mapę).
+    Zwraca (best, prev, hit): best[e] – najlepszy czas dojścia końcem krawędzi e, prev[e] – poprzednia
+    krawędź (-1 dla wyjścia z mapy startowej), hit – krawędź, którą osiągnięto target (albo -1).
+    target < 0: przeszukuje cały osiągalny graf; goals – zbiór indeksów map: koniec, gdy wszystkie
+    osiągnięte (min best po krawędziach do nich jest już ostateczny). costs – _LegCosts
+    (wspólne dla kilku przeszukiwań jednego planu), domyślnie brane teraz.
+    """
+    goals = set(goals) if goals else None
+    costs = costs or _LegCosts()
+    exits = costs.exits
+    offsets, targets, ids = db.offsets, db.targets, db.ids
+    inf = float("inf")
+    push, pop = heapq.heappush, heapq.heappop
+    best = {}
+    prev = {}
+    heap = []
+    for e in range(offsets[start], offsets[start + 1]):
+        c = costs.leg_sec(ids[start], None, start_pos, db.gateway_id(e))
+        if c < best.get(e, inf):
+            best[e] = c
+            prev[e] = -1
+            push(heap, (c, e, start))
+    while heap:
+        c, e, u = pop(heap)
+        if c > best[e]:
+            continue
+        v = targets[e]
+        if v == target:
+            return best, prev, e
+        if goals is not None and v in goals:
+            goals.discard(v)
+            if not goals:
+                break
+        for f, sec in exits(db, u, v):
+            nc = c + sec
+            if nc < best.get(f, inf):
+                best[f] = nc
+                prev[f] = e
+                push(heap, (nc, f, v))
+    return best, prev, -1
+
+
+def plan_route(start_map_id, target_map_id, start_pos=None):
+    """
+    Trasa o najmniejszym szacowanym czasie (Dijkstra po krawędziach – koszt kroku zależy od
+    bramy, którą weszliśmy na mapę). start_pos – pozycja bohatera (x, y) na mapie startowej.
+    Brama wejściowa na mapie v od strony u to brama o ID mapy u (ID bram = ID map docelowych).
+    Wynik jak bfs_path: lista (gateway_id, target_map_id), [] gdy start == target, None gdy brak trasy.
+    Bez poznanej geometrii wszystkie kroki kosztują tyle samo – wynik ma najmniej przejść.
+    """
+    db = _load_maps()
+    start = db.index.get(_normalize_id(start_map_id))
+    target = db.index.get(_normalize_id(target_map_id))
+    if start is None or target is None:
+        return None
+    if start == target:
+        return []
+    if not db.reachable(start, target):
+        return None
+    _best, prev, e = _route_search(db, start, start_pos, target)
+    if e < 0:
+        return None
+    edges = []
+    while e >= 0:
+        edges.append(e)
+        e = prev[e]
+    edges.reverse()
+    return db.path_of_edges(edges)
+
+
+def travel_times_from(start_map_id, start_pos=None):
+    """Szacowany czas dojścia (s) z mapy start_map_id do każdej osiągalnej mapy: dict map_id -> s."""
+    db = _load_maps()
+    start = db.index.get(_normalize_id(start_map_id))
+    if start is None:
         return {}
-    dist = {start: 0}
-    queue = deque([start])
-    while queue:
-        current = queue.popleft()
-        d = dist[current]
-        for _gw_id, next_id in _graph.get(current, []):
-            if next_id not in dist:
-                dist[next_id] = d + 1
-                queue.append(next_id)
-    return dist
+    best, _prev, _hit = _route_search(db, start, start_pos)
+    arrival = {start: 0.0}
+    targets = db.targets
+    for e, c in best.items():
+        v = targets[e]
+        if c < arrival.get(v, float("inf")):
+            arrival[v] = c
+    return {db.ids[i]: c for i, c in arrival.items()}
+
+
+def _arrival_sec(db, start, start_pos, goals, costs=None):
+    """Czasy dojścia z mapy start do map goals (indeksy): dict indeks -> s; nieosiągalne pominięte."""
+    goals = [g for g in goals if g == start or db.reachable(start, g)]
+    out = {g: 0.0 for g in goals if g == start}
+    rest = [g for g in goals if g != start]
+    if not rest:
+        return out
+    best, _prev, _hit = _route_search(db, start, start_pos, goals=rest, costs=costs)
+    targets = db.targets
+    wanted = set(rest)
+    for e, c in best.items():
+        v = targets[e]
+        if v in wanted and c < out.get(v, float("inf")):
+            out[v] = c
+    return out
+
+
+class TourPlanner:
+    """
+    Kolejność odwiedzenia wielu map (np. kolejka procesów ataku) o najmniejszym łącznym
+    szacowanym czasie dojść: najbliższy sąsiad jako start, potem 2-opt (trasa otwarta,
+    czasy niesymetryczne – wyjścia jednokierunkowe).
+    Macierz czasów buduje się wierszami (Dijkstra z mapy źródłowej, zatrzymany po osiągnięciu
+    wszystkich celów) na jednej kopii kosztów (_LegCosts) na plan. Wiersze map docelowych są
+    pamiętane, więc po dodaniu procesu liczony jest tylko wiersz startu i brakujące pola.
+    Pamięć jest czyszczona sama, gdy zmieni się graf (przeładowanie, nakładka), dojdą pomiary
+    czasów (travel_times) albo geometria map; invalidate() – wymuszenie.
+    """
+
+    def __init__(self):
+        self._rows = {}  # indeks mapy źródłowej -> {indeks celu: s | None}
+        self._db = None
+        self._generation = None
+        self._costs = None
+        self._lock = threading.Lock()
+        self.rows_computed = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._rows = {}
+            self._costs = None
+
+    def _row(self, db, src, goals, costs):
+        """Wiersz macierzy dla mapy src (pamiętany); None – cel nieosiągalny."""
+        row = self._rows.setdefault(src, {})
+        missing = [g for g in goals if g not in row]
+        if missing:
+            found = _arrival_sec(db, src, None, missing, costs)
+            for g in missing:
+                row[g] = found.get(g)
+            self.rows_computed += 1
+        return row
+
+    def plan(self, start_map_id, target_map_ids, start_pos=None):
+        """
+        Kolejność odwiedzenia target_map_ids startując z mapy start_map_id (pozycja start_pos).
+        Zwraca (order, unreachable, total_sec): order – pozycje w target_map_ids w kolejności
+        odwiedzania, unreachable – pozycje celów bez trasy (kolejność wejściowa), total_sec –
+        szacowany łączny czas dojść po trasie order.
+        """
+        db = _load_maps()
+        start = db.index.get(_normalize_id(start_map_id))
+        nodes = [db.index.get(_normalize_id(t)) for t in target_map_ids]
+        if start is None:
+            return [], list(range(len(nodes))), 0.0
+        with self._lock:
+            generation = _plan_generation()
+            if self._db is not db or self._generation != generation or self._costs is None:
+                self._db, self._generation, self._rows = db, generation, {}
+                self._costs = _LegCosts()
+            costs = self._costs
+            goals = sorted(set(i for i in nodes if i is not None))
+            first = _arrival_sec(db, start, start_pos, goals, costs)
+            ok = [k for k, i in enumerate(nodes) if i is not None and i in first]
+            unreachable = [k for k, i in enumerate(nodes) if i is None or i not in first]
+            rows = {i: self._row(db, i, goals, costs) for i in set(nodes[k] for k in ok)}
+        inf = float("inf")
+
+        def cost(a, b):
+            # a = None – start (pozycja bohatera), inaczej pozycja w target_map_ids
+            if a is None:
+                return first[nodes[b]]
+            c = rows[nodes[a]].get(nodes[b])
+            return inf if c is None else c
+
+        def length(route):
+            total, prev = 0.0, None
+            for k in route:
+                total += cost(prev, k)
+                prev = k
+            return total
+
+        # najbliższy sąsiad
+        route, left, prev = [], set(ok), None
+        while left:
+            k = min(left, key=lambda k: (cost(prev, k), k))
+            route.append(k)
+            left.discard(k)
+            prev = k
+        # 2-opt: odwracanie odcinków route[i..j]; przy czasach niesymetrycznych odwrócenie często
+        # nie pomaga, więc też przenoszenie pojedynczej mapy w inne miejsce (or-opt) – dopóki skraca trasę
+        best = length(route)
+        improved = True
+        while improved:
+            improved = False
+            n = len(route)
+            for i in range(n - 1):
+                for j in range(i + 1, n):
+                    cand = route[:i] + route[i:j + 1][::-1] + route[j + 1:]
+                    c = length(cand)
+                    if c < best - 1e-9:
+                        route, best, improved = cand, c, True
+            for i in range(n):
+                rest = route[:i] + route[i + 1:]
+                for j in range(n):
+                    if j == i:
+                        continue
+                    cand = rest[:j] + [route[i]] + rest[j:]
+                    c = length(cand)
+                    if c < best - 1e-9:
+                        route, best, improved = cand, c, True
+                        break
+        return route, unreachable, best
+
+
+def estimate_route_sec(start_map_id, path, start_pos=None):
+    """Szacowany czas (s) przejścia ścieżki path (lista (gateway_id, target_map_id)) z mapy start_map_id."""
+    if path is None:
+        return None
+    costs = _LegCosts()
+    total = 0.0
+    current = _normalize_id(start_map_id)
+    entry_gw = None
+    pos = start_pos
+    for gw_id, next_id in path:
+        gw_id, next_id = _normalize_id(gw_id), _normalize_id(next_id)
+        total += costs.leg_sec(current, entry_gw, pos, gw_id)
+        entry_gw = current
+        pos = costs.gateway_pos(next_id, current)
+        current = next_id
+    return total
 
 
 def get_neighbor_map_ids(map_id):
     """
     Zwraca listę ID map bezpośrednio sąsiadujących z map_id (jedno przejście bramą).
     """
-    _load_maps()
+    db = _load_maps()
     mid = _normalize_id(map_id)
-    if mid not in _graph:
+    if mid not in db.index:
         return []
-    return [next_id for _gw_id, next_id in _graph[mid]]
+    return [next_id for _gw_id, next_id in db.edges(mid)]
 
 
 def get_maps_with_npc(name_substring):
     """
-    Zwraca listę map, na których występuje NPC o nazwie zawierającej name_substring.
+    Zwraca listę map, na których występuje NPC o nazwie zawierającej name_substring
+    (bez rozróżniania wielkości liter i znaków diakrytycznych).
     Każdy element: (map_id, map_name, total_count) – total_count to suma pól count
-    ze wszystkich wpisów NPC na tej mapie pasujących do nazwy.
+    ze wszystkich wpisów NPC na tej mapie pasujących do nazwy (sumy per nazwa liczone przy wczytaniu).
     """
-    _load_maps()
-    part = (name_substring or "").strip().lower()
+    db = _load_maps()
+    part = fold_text((name_substring or "").strip())
     if not part:
         return []
-    out = []
-    for mid, info in _maps_data.items():
-        map_name = (info.get("name") or "").strip() or mid
-        npcs = info.get("npcs") or []
-        total = 0
-        for n in npcs:
-            nname = (n.get("name") or "").strip().lower()
-            if part in nname:
-                total += int(n.get("count") or 0)
-        if total > 0:
-            out.append((mid, map_name, total))
+    npc = db.npc
+    totals = {}
+    for k in npc.text.search(part):
+        for i, count in npc.maps[k]:
+            totals[i] = totals.get(i, 0) + count
+    out = [(db.ids[i], db.names[i] or db.ids[i], total) for i, total in totals.items() if total > 0]
     return sorted(out, key=lambda x: (-x[2], x[1].lower()))
 
 
+def get_map_npcs(map_id):
+    """Grupy NPC na mapie map_id: lista NpcGroup (name, level, count), kolejność jak w JSON."""
+    db = _load_maps()
+    i = db.index.get(_normalize_id(map_id))
+    if i is None:
+        return []
+    return db.npc.groups(i)
+
+
+def find_hunting_grounds(level_min, level_max, current_map_id=None, start_pos=None, limit=20):
+    """
+    Łowiska: mapy z potworami o poziomie w [level_min, level_max], ocenione jako liczba potworów
+    na szacowany czas dojścia z current_map_id (travel_times_from + HUNT_TRAVEL_OFFSET_SEC).
+    Mapy nieosiągalne ze znanej mapy startowej są pomijane. Gdy mapa startowa jest nieznana
+    (brak current_map_id albo mapy w grafie) lub nie da się z niej dojść do żadnego łowiska –
+    ranking tylko po liczbie potworów, travel_sec = None (takie wpisy zawsze na końcu).
+    Zwraca do limit elementów (map_id, map_name, total_count, travel_sec | None, top_npc_name),
+    top_npc_name – najliczniejsza grupa w zakresie (nazwa do ataku).
+    """
+    db = _load_maps()
+    if level_min > level_max:
+        level_min, level_max = level_max, level_min
+    npc = db.npc
+    per_map = {}  # indeks_mapy -> {k: suma count}
+    lv_map, lv_count, lv_npc = npc.lv_map, npc.lv_count, npc.lv_npc
+    for r in npc.in_levels(level_min, level_max):
+        counts = per_map.setdefault(lv_map[r], {})
+        k = lv_npc[r]
+        counts[k] = counts.get(k, 0) + lv_count[r]
+    travel = None
+    if _normalize_id(current_map_id) in db.index:
+        travel = travel_times_from(current_map_id, start_pos=start_pos)
+
+    def rank(travel):
+        out = []
+        for i, counts in per_map.items():
+            total = sum(counts.values())
+            if total <= 0:
+                continue
+            mid = db.ids[i]
+            sec = None
+            if travel is not None:
+                sec = travel.get(mid)
+                if sec is None:
+                    continue
+            top = max(counts.items(), key=lambda kv: kv[1])[0]
+            score = total / ((sec or 0.0) + HUNT_TRAVEL_OFFSET_SEC)
+            out.append((score, mid, db.names[i] or mid, total, sec, npc.display[top]))
+        return out
+
+    out = rank(travel)
+    if not out and travel is not None:
+        out = rank(None)
+    out.sort(key=lambda r: (r[4] is None, -r[0], r[2].lower()))
+    return [r[1:] for r in out[:limit]]
+
+
 def get_maps_with_npc_by_distance(name_substring, current_map_id):
     """
     Jak get_maps_with_npc, ale pogrupowane wg odległości BFS od current_map_id.
@@ -5,8 +5,380 @@ Użycie: api = MargonemAPI(driver); api.ensure_context(); api.hero.get_position(
 Wszystkie metody przyjmują driver (Selenium) i wykonują execute_script w kontekście gry.
 """
 import random
+import threading
 import time
-from game_context import ensure_game_context, is_engine_ready
+import weakref
+from contextlib import contextmanager
+from urllib.parse import quote
+from game_context import (
+    ensure_game_context_cached,
+    get_context_state,
+    invalidate_game_context,
+    is_engine_ready,
+    mark_default_content,
+)
+from maps_graph import observe_gateways, plan_route, record_map_geometry
+from page_agent import PageAgent
+from page_scripts import CALL_ASYNC_JS, CALL_JS, install_source, is_missing, register_script, scripts_version
+from polling import PollingPolicy, get_call_budget, wait_while_paused
+from gateway_cache import get_gateway_pos, has_map, remember_gateways
+from travel_times import record_travel
+
+# Jak długo (s) migawka stanu świata z get_snapshot() jest uznawana za aktualną.
+SNAPSHOT_TTL_SEC = 0.25
+
+# Maks. czas (s) jednego execute_async_script w oczekiwaniach w stronie (wait_*). Między
+# kolejnymi wycinkami Python sprawdza captcha i limity czasu; musi być < script timeout drivera.
+IN_PAGE_WAIT_SLICE_SEC = 3.0
+
+# Wyjątki WebDrivera wskazujące na nieaktualny kontekst gry: ramka / okno zniknęły, element
+# nieaktualny albo błąd JS (po przeładowaniu strony driver trafia do ramki bez Engine – ReferenceError).
+# Po nich _exec unieważnia kontekst, szuka ramki od nowa i ponawia odczyt raz. Komend
+# (_exec_command) nie ponawia nigdy – mogły już zadziałać.
+CONTEXT_ERRORS = (
+    "NoSuchFrameException", "NoSuchWindowException", "StaleElementReferenceException", "JavascriptException",
+)
+
+# move_towards: nowy autoGoTo tylko gdy cel odsunął się od bieżącego celu ruchu o więcej niż
+# MOVE_RETARGET_TILES kratek albo bohater nie zmienia pozycji od MOVE_STALL_SEC sekund.
+MOVE_RETARGET_TILES = 1
+MOVE_STALL_SEC = 1.5
+
+# Szacunki do ETA polityki odpytywania (polling.PollingPolicy.expect): prędkość bohatera
+# (kratki/s), czas walki z ff=1 i czas przejścia przez bramę po dojściu na nią.
+HERO_TILES_PER_SEC = 4.0
+BATTLE_END_ETA_SEC = 1.0
+MAP_CHANGE_ETA_SEC = 1.0
+
+# attack_entity_by_name: po odpowiedzi na atak – ile czekać na start walki (blokada 'battle')
+# i najdłuższy czas samej walki.
+BATTLE_START_WAIT_SEC = 1.0
+BATTLE_TIMEOUT_SEC = 60
+
+# AutoHeal: najwięcej tyle mikstur wypijanych w jednej paczce komend (batch) i odstęp między nimi.
+AUTOHEAL_MAX_POTIONS = 3
+AUTOHEAL_POTION_SPACING_MS = 150
+
+# Komendy do serwera (_g, send2, autoGoTo) jednego drivera idą po kolei – paczka z odstępami
+# (batch(spacing_ms)) kończy się, zanim wyjdzie kolejna komenda z innego wątku / instancji.
+_command_locks = weakref.WeakKeyDictionary()
+_command_locks_lock = threading.Lock()
+
+
+def _get_command_lock(driver):
+    """Wspólna (dla wszystkich instancji MargonemAPI) blokada wysyłania komend danego drivera."""
+    with _command_locks_lock:
+        lock = _command_locks.get(driver)
+        if lock is None:
+            lock = threading.RLock()
+            _command_locks[driver] = lock
+        return lock
+
+# --- Pomocnicy JS instalowani raz na stronę (page_scripts) ---
+
+register_script("snapshot", """
+function () {
+    if (typeof Engine === 'undefined' || !Engine) return null;
+    var out = { hero: null, map: {}, locks: {}, npcs: [], gateways: [], items: [] };
+    if (Engine.hero && Engine.hero.d) out.hero = { x: Engine.hero.d.x, y: Engine.hero.d.y };
+    var m = Engine.map;
+    if (m) out.map = {
+        id: m.d && m.d.id, name: m.d && m.d.name,
+        size_x: m.size && m.size.x, size_y: m.size && m.size.y
+    };
+    if (Engine.lock) out.locks = {
+        any: !!Engine.lock.check(),
+        battle: !!Engine.lock.check('battle'),
+        npcdialog: !!Engine.lock.check('npcdialog'),
+        change_location: !!Engine.lock.check('change_location')
+    };
+    var npcs = Engine.npcs ? Engine.npcs.check() : {};
+    for (var id in npcs) {
+        var n = npcs[id];
+        if (n && n.d) out.npcs.push({ id: n.d.id, x: n.d.x, y: n.d.y, nick: (n.d.nick || '') });
+    }
+    var gates = m && m.gateways ? m.gateways.getList() : [];
+    for (var j = 0; j < gates.length; j++) {
+        var g = gates[j];
+        if (g && g.d) out.gateways.push({ id: g.d.id, x: g.d.x, y: g.d.y });
+    }
+    var items = m && m.groundItems ? m.groundItems.getDrawableItems() : [];
+    for (var i = 0; i < items.length; i++) {
+        var o = items[i];
+        if (o && o.i) out.items.push({ id: String(o.i.id), x: o.i.x, y: o.i.y, name: (o.i.name || '') });
+    }
+    return out;
+}
+""")
+
+register_script("heroStats", """
+function () {
+    if (!Engine || !Engine.hero || !Engine.hero.d) return null;
+    var d = Engine.hero.d, ws = d.warrior_stats || {};
+    return {
+        hp: ws.hp, maxhp: ws.maxhp, lvl: d.lvl, gold: d.gold,
+        nick: d.nick, id: d.id, dir: d.dir, prof: d.prof
+    };
+}
+""")
+
+register_script("heroHpForHeal", """
+function () {
+    if (!Engine || !Engine.hero) return null;
+    var data = (typeof Engine.hero.getData === 'function') ? Engine.hero.getData() : Engine.hero.d;
+    if (!data) return null;
+    var visualHP = parseInt(data.hp, 10) || 0;
+    var visualMax = parseInt(data.maxhp, 10) || 1;
+    return { visual_hp: visualHP, visual_maxhp: visualMax };
+}
+""")
+
+register_script("healPotions", """
+function () {
+    if (!Engine || !Engine.items || typeof Engine.items.fetchLocationItems !== 'function') return [];
+    var raw = Engine.items.fetchLocationItems('g') || [];
+    var res = [];
+    for (var i = 0; i < raw.length; i++) {
+        var it = raw[i];
+        var obj = (it.i != null) ? it.i : it;
+        var s = (obj._cachedStats != null) ? obj._cachedStats : (it._cachedStats || {});
+        if (s.leczy != null) res.push({ id: obj.id, name: (obj.name || ''), val: parseInt(s.leczy, 10) || 0, type: 'heal' });
+        if (s.fullheal != null) res.push({ id: obj.id, name: (obj.name || ''), val: 999999, type: 'full' });
+    }
+    return res;
+}
+""")
+
+register_script("mapInfo", """
+function () {
+    if (!Engine || !Engine.map) return {};
+    var m = Engine.map;
+    return {
+        id: m.d && m.d.id, name: m.d && m.d.name,
+        size_x: m.size && m.size.x, size_y: m.size && m.size.y
+    };
+}
+""")
+
+register_script("groundItems", """
+function () {
+    var raw = Engine && Engine.map && Engine.map.groundItems
+        ? Engine.map.groundItems.getDrawableItems() : [];
+    var out = [];
+    for (var i = 0; i < raw.length; i++) {
+        var o = raw[i];
+        if (o && o.i) out.push({ id: String(o.i.id), x: o.i.x, y: o.i.y, name: (o.i.name || '') });
+    }
+    return out;
+}
+""")
+
+register_script("gateways", """
+function () {
+    var gates = Engine && Engine.map && Engine.map.gateways ? Engine.map.gateways.getList() : [];
+    var out = [];
+    for (var j = 0; j < gates.length; j++) {
+        var g = gates[j];
+        if (g && g.d) out.push({ id: g.d.id, x: g.d.x, y: g.d.y });
+    }
+    return out;
+}
+""")
+
+register_script("floatObjects", """
+function () {
+    var list = Engine && Engine.floatObjectManager
+        ? Engine.floatObjectManager.getDrawableList() : [];
+    var out = [];
+    for (var k = 0; k < list.length; k++) {
+        var o = list[k];
+        if (o && o.id != null && (o.x != null || (o.d && o.d.x != null))) {
+            out.push({ id: o.id, x: o.x != null ? o.x : o.d.x, y: o.y != null ? o.y : o.d.y });
+        }
+    }
+    return out;
+}
+""")
+
+register_script("npcsList", """
+function () {
+    var npcs = Engine && Engine.npcs ? Engine.npcs.check() : {};
+    var list = [];
+    for (var id in npcs) {
+        var n = npcs[id];
+        if (n && n.d) list.push({ id: n.d.id, x: n.d.x, y: n.d.y, nick: (n.d.nick || '') });
+    }
+    return list;
+}
+""")
+
+register_script("npcById", """
+function (id) {
+    var npc = (Engine && Engine.npcs && Engine.npcs.getById) ? Engine.npcs.getById(id) : null;
+    if (!npc || !npc.d) return null;
+    return { id: npc.d.id, x: npc.d.x, y: npc.d.y, nick: (npc.d.nick || '') };
+}
+""")
+
+register_script("nearestNpcs", """
+function (filter, k) {
+    if (!Engine || !Engine.hero || !Engine.hero.d) return [];
+    var hx = Engine.hero.d.x, hy = Engine.hero.d.y;
+    var npcs = Engine.npcs ? Engine.npcs.check() : {};
+    var out = [];
+    for (var id in npcs) {
+        var n = npcs[id];
+        if (!n || !n.d) continue;
+        var nick = n.d.nick || '';
+        if (nick.toLowerCase().indexOf(filter) === -1) continue;
+        out.push({ id: n.d.id, x: n.d.x, y: n.d.y, nick: nick, dist: Math.abs(n.d.x - hx) + Math.abs(n.d.y - hy) });
+    }
+    out.sort(function (a, b) { return a.dist - b.dist; });
+    return out.slice(0, k);
+}
+""")
+
+register_script("gBatch", """
+function (tasks) {
+    if (typeof _g !== 'function') return false;
+    for (var i = 0; i < tasks.length; i++) _g(tasks[i]);
+    return true;
+}
+""")
+
+register_script("gBatchSpaced", """
+function (tasks, spacingMs, done) {
+    if (typeof _g !== 'function') return done(false);
+    var k = 0;
+    (function next() {
+        _g(tasks[k++]);
+        if (k < tasks.length) setTimeout(next, spacingMs);
+        else done(true);
+    })();
+}
+""")
+
+# gTracked: odpowiedzi nieodebrane przez awaitResponse (wait() nie wywołane albo po timeoucie)
+# są usuwane po 60 s, a w magazynie zostaje najwyżej 100 najnowszych.
+register_script("gTracked", """
+function (task) {
+    if (typeof _g !== 'function') return false;
+    var store = window.__mbotResp = window.__mbotResp || { next: 0, done: {} };
+    var token = ++store.next, now = Date.now(), keys = Object.keys(store.done);
+    for (var i = 0; i < keys.length; i++) {
+        if (now - store.done[keys[i]].t > 60000 || keys.length - i > 100) delete store.done[keys[i]];
+    }
+    _g(task, function () {
+        var pkg = (Engine && Engine.communication && Engine.communication.getFullDataPackage)
+            ? (Engine.communication.getFullDataPackage() || {}) : {};
+        store.done[token] = { t: Date.now(), r: {
+            e: pkg.e != null ? String(pkg.e) : null, ok: pkg.e == null || pkg.e === 'ok',
+            keys: Object.keys(pkg), npcs_del: pkg.npcs_del || null, lag: pkg.lag != null ? pkg.lag : null
+        } };
+    });
+    return token;
+}
+""")
+
+register_script("awaitResponse", """
+function (token, timeoutMs, done) {
+    var store = window.__mbotResp || { done: {} }, start = Date.now();
+    (function check() {
+        var r = store.done[token];
+        if (r) { delete store.done[token]; return done({ arrived: true, response: r.r }); }
+        if (Date.now() - start >= timeoutMs) return done({ arrived: false });
+        setTimeout(check, 25);
+    })();
+}
+""")
+
+register_script("waitFor", """
+function (kind, p, sliceMs, done) {
+    var start = Date.now(), lastMove = start, sx = null, sy = null, x = null, y = null;
+    function finish(met, mapId) {
+        done({ met: met, x: x, y: y, map_id: mapId, moved: lastMove > start,
+               idle_ms: Date.now() - lastMove });
+    }
+    function check() {
+        var mapId = null;
+        try {
+            var d = Engine && Engine.hero && Engine.hero.d;
+            if (d) {
+                if (sx === null) { sx = d.x; sy = d.y; }
+                if (x !== null && (d.x !== x || d.y !== y)) lastMove = Date.now();
+                else if (x === null && (d.x !== sx || d.y !== sy)) lastMove = Date.now();
+                x = d.x; y = d.y;
+            }
+            mapId = Engine && Engine.map && Engine.map.d ? Engine.map.d.id : null;
+            if (kind === 'near' && d && Math.abs(d.x - p.x) + Math.abs(d.y - p.y) <= p.distance) return finish(true, mapId);
+            if (kind === 'map' && mapId != null && Number(mapId) === Number(p.id)) return finish(true, mapId);
+            if (kind === 'battle_end' && Engine && Engine.lock && !Engine.lock.check('battle')) return finish(true, mapId);
+            if (kind === 'battle_start' && Engine && Engine.lock && Engine.lock.check('battle')) return finish(true, mapId);
+        } catch (e) {}
+        if (Date.now() - start >= sliceMs) return finish(false, mapId);
+        setTimeout(check, 50);
+    }
+    check();
+}
+""")
+
+
+class ActionResult:
+    """
+    Oczekiwanie na odpowiedź serwera na komendę _g (zwracane przez akcje z wait_response=True).
+    wait(timeout_sec) -> dict {e, ok, keys, npcs_del, lag} z pakietu getFullDataPackage()
+    po nadejściu odpowiedzi albo None (timeout / nie udało się podpiąć callbacku).
+    """
+
+    def __init__(self, api, token, task):
+        self.api = api
+        self.token = token
+        self.task = task
+        self.response = None
+
+    @property
+    def tracked(self):
+        """Czy odpowiedź jest śledzona (False – zostaje stałe czekanie po stronie wywołującego)."""
+        return self.token is not None
+
+    def wait(self, timeout_sec=5.0):
+        """Czeka (w stronie, wycinkami) na odpowiedź serwera; zwraca sparsowany dict lub None."""
+        if self.response is not None or self.token is None:
+            return self.response
+        deadline = time.time() + timeout_sec
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            try:
+                r = self.api._call_async(
+                    "awaitResponse", self.token, int(min(IN_PAGE_WAIT_SLICE_SEC, remaining) * 1000)
+                )
+            except Exception:
+                return None
+            if isinstance(r, dict) and r.get("arrived"):
+                self.response = r.get("response") or {}
+                return self.response
+
+
+class _WalkProgress:
+    """
+    Postęp jednego marszu w pętlach odpytujących: zmiana pozycji bohatera to zwykły postęp
+    (nie zdarzenie dla PollingPolicy), zatrzymanie – brak zmiany pozycji od MOVE_STALL_SEC.
+    """
+
+    def __init__(self, pos):
+        self.last_pos = pos
+        self.last_move = time.time()
+
+    def stalled(self, pos):
+        """Zapisuje pozycję; True gdy bohater stoi od MOVE_STALL_SEC sekund."""
+        now = time.time()
+        if pos is None or pos != self.last_pos:
+            self.last_pos = pos
+            self.last_move = now
+            return False
+        return now - self.last_move >= MOVE_STALL_SEC
 
 
 class MargonemAPI:
@@ -19,46 +391,239 @@ class MargonemAPI:
         self.driver = driver
         self.log = log_callback or (lambda msg: None)
         self.captcha_check = captcha_check  # callable(driver) -> "skipped_tries" | None; po wywołaniu przywracamy kontekst gry
+        self._snapshot = None  # ostatnia migawka z get_snapshot()
+        self._snapshot_time = 0.0
+        self._agent = None  # PageAgent – tworzony przy pierwszym użyciu
+        self._async_unsupported = False  # driver nie obsługuje execute_async_script – wait_* odpytują z Pythona
+        self.scripts_installs = 0  # ile razy ta instancja instalowała pomocników JS w stronie
+        self._batch = None  # lista komend _g kolejkowanych w bloku batch()
+        self._map_visit = None  # (ID mapy, znacznik wizyty) – dla observe_gateways
+        self._move_dest = None  # (x, y) ostatniego autoGoTo
+        self._move_last_hero = None  # ostatnia znana pozycja bohatera (move_towards)
+        self._move_last_progress = 0.0  # kiedy bohater ostatnio zmienił pozycję / dostał nowy cel
+        self.moves_issued = 0
+        self.moves_suppressed = 0
+        self._budget = get_call_budget(driver)  # budżet wywołań WebDrivera wspólny dla drivera
+        self._command_lock = _get_command_lock(driver)  # kolejność komend wspólna dla drivera
 
     def ensure_context(self):
-        """Przełącza na iframe z grą i zwraca True jeśli Engine jest gotowy."""
-        return ensure_game_context(self.driver)
+        """
+        Przełącza na iframe z grą i zwraca True jeśli Engine jest gotowy.
+        Stan jest zapamiętany per driver – przeglądarka jest odpytywana ponownie dopiero
+        po invalidate_context() (błąd skryptu, przełączenie ramki).
+        """
+        return ensure_game_context_cached(self.driver)
+
+    def invalidate_context(self):
+        """Wymusza ponowne szukanie ramki gry przy następnym ensure_context()."""
+        invalidate_game_context(self.driver)
+
+    def context_stats(self):
+        """Liczniki kontekstu: hits, probes, reprobes, reentries, invalidations (wspólne dla drivera)."""
+        return get_context_state(self.driver).stats()
 
     def is_ready(self):
         """Czy Engine jest dostępny (jesteśmy w grze)."""
         return is_engine_ready(self.driver)
 
-    # --- Akcje (_g) ---
+    def polling_policy(self, **kwargs):
+        """Nowa PollingPolicy dla jednej pętli oczekiwania, podpięta pod budżet wywołań drivera."""
+        return PollingPolicy(budget=self._budget, **kwargs)
+
+    def poll_stats(self):
+        """Budżet wywołań WebDrivera: rate (wywołań/s), calls, throttled (wspólne dla drivera)."""
+        return self._budget.stats()
+
+    def _exec(self, script, *args, replay=True):
+        """
+        execute_script w kontekście gry. Po błędzie kontekstu (CONTEXT_ERRORS – np. po przeładowaniu
+        strony lub przełączeniu ramki) unieważnia kontekst, szuka ramki od nowa i przy replay=True
+        (odczyty) ponawia wywołanie raz. Inne wyjątki (np. timeout) idą dalej bez ponawiania.
+        Komendy wysyła _exec_command (replay=False – skrypt mógł już zadziałać).
+        """
+        return self._run(self.driver.execute_script, script, args, replay)
+
+    def _exec_async(self, script, *args, replay=True):
+        """Jak _exec, ale execute_async_script (ostatni argument skryptu to callback zwracający wynik)."""
+        return self._run(self.driver.execute_async_script, script, args, replay)
 
-    def _g(self, task_string):
-        """Wysłanie komendy do serwera: _g(taskString)."""
+    def _run(self, execute, script, args, replay):
         self.ensure_context()
-        self.driver.execute_script(
-            "if (typeof _g === 'function') _g(arguments[0]);",
-            task_string,
-        )
+        self._budget.note_call()
+        try:
+            return execute(script, *args)
+        except Exception as e:
+            if type(e).__name__ not in CONTEXT_ERRORS:
+                raise
+            self.invalidate_context()
+            if not replay or not self.ensure_context():
+                raise
+            self._budget.note_call()
+            return execute(script, *args)
+
+    def _exec_command(self, script, *args, wait=False):
+        """
+        Skrypt wysyłający komendę (_g, send2, autoGoTo) – nigdy nie jest powtarzany po wyjątku,
+        bo mógł już zadziałać. Skrypt sam sprawdza kontekst: zwraca false (albo znacznik braku
+        pomocników), gdy w ramce nie ma gry – wtedy niczego nie wysłał i tylko wtedy idzie
+        ponownie, po odnalezieniu ramki. Zwraca wynik skryptu albo None po wyjątku.
+        wait=True – skrypt asynchroniczny (execute_async_script): wraca po jego callbacku.
+        Komendy drivera są wysyłane po kolei (blokada wspólna dla drivera).
+        """
+        run = self._exec_async if wait else self._exec
+        with self._command_lock:
+            try:
+                r = run(script, *args, replay=False)
+                if is_missing(r):
+                    self.install_scripts()
+                    r = run(script, *args, replay=False)
+                if r is False:
+                    # zapamiętany kontekst był nieaktualny – komenda nie wyszła
+                    self.invalidate_context()
+                    if self.ensure_context():
+                        r = run(script, *args, replay=False)
+                return r
+            except Exception as e:
+                self.invalidate_context()
+                self.log("Komenda mogła nie dojść (błąd skryptu: {}).".format(type(e).__name__))
+                return None
 
-    def talk_start(self, npc_id):
-        """Rozpoczęcie rozmowy z NPC: talk&id=ID."""
-        self._g("talk&id=" + str(int(npc_id)))
+    def install_scripts(self):
+        """Instaluje w stronie wszystkich pomocników z page_scripts (window.__mbot)."""
+        self._exec(install_source())
+        self.scripts_installs += 1
+
+    def _call(self, name, *args):
+        """
+        Wywołuje pomocnika JS zarejestrowanego w page_scripts – do przeglądarki idzie tylko
+        nazwa i argumenty. Gdy strony nie ma pomocników (przeładowanie), instaluje je i ponawia.
+        """
+        r = self._exec(CALL_JS, scripts_version(), name, list(args))
+        if is_missing(r):
+            self.install_scripts()
+            r = self._exec(CALL_JS, scripts_version(), name, list(args))
+        return r
+
+    def _call_async(self, name, *args):
+        """Jak _call, ale dla pomocnika asynchronicznego (ostatni argument funkcji JS to callback)."""
+        r = self._exec_async(CALL_ASYNC_JS, scripts_version(), name, list(args))
+        if is_missing(r):
+            self.install_scripts()
+            r = self._exec_async(CALL_ASYNC_JS, scripts_version(), name, list(args))
+        return r
+
+    def _wait_in_page(self, kind, params, slice_sec):
+        """
+        Jeden wycinek oczekiwania w stronie: Promise sprawdzany co 50 ms w przeglądarce,
+        rozwiązywany od razu gdy warunek jest spełniony, najpóźniej po slice_sec.
+        kind: "near" (params: x, y, distance), "map" (params: id), "battle_end", "battle_start".
+        Zwraca dict {met, x, y, map_id, moved, idle_ms} lub None gdy nie da się czekać w stronie.
+        """
+        if self._async_unsupported:
+            return None
+        try:
+            r = self._call_async("waitFor", kind, params or {}, int(max(0.05, slice_sec) * 1000))
+        except AttributeError:
+            # driver bez execute_async_script – nie próbujemy ponownie
+            self._async_unsupported = True
+            return None
+        except Exception:
+            return None
+        return r if isinstance(r, dict) else None
+
+    # --- Akcje (_g) ---
+
+    def _g(self, task_string, spacing_ms=0):
+        """
+        Wysłanie komendy do serwera: _g(taskString).
+        task_string może być listą komend – wtedy idą jednym execute_script, a spacing_ms
+        (odstęp między kolejnymi komendami) jest odmierzany w stronie; wtedy _g wraca dopiero
+        po wysłaniu ostatniej komendy, a komendy z innych wątków czekają na koniec paczki.
+        Wewnątrz bloku batch() komendy są tylko kolejkowane.
+        """
+        tasks = [task_string] if isinstance(task_string, str) else list(task_string)
+        if not tasks:
+            return
+        if self._batch is not None:
+            self._batch.extend(tasks)
+            return
+        self.invalidate_snapshot()
+        if len(tasks) == 1:
+            self._exec_command("if (typeof _g !== 'function') return false; _g(arguments[0]); return true;", tasks[0])
+        elif not spacing_ms:
+            self._exec_command(CALL_JS, scripts_version(), "gBatch", [tasks])
+        elif self._async_unsupported or not hasattr(self.driver, "execute_async_script"):
+            # bez execute_async_script odstęp odmierza Python – pod blokadą, jak paczka w stronie
+            with self._command_lock:
+                for i, task in enumerate(tasks):
+                    if i:
+                        time.sleep(spacing_ms / 1000.0)
+                    self._g(task)
+        else:
+            self._exec_command(CALL_ASYNC_JS, scripts_version(), "gBatchSpaced", [tasks, int(spacing_ms)], wait=True)
+
+    def _g_tracked(self, task_string):
+        """
+        Jak _g, ale z callbackiem na odpowiedź serwera – zwraca ActionResult.
+        Gdy callbacku nie da się podpiąć, komenda idzie zwykłym _g, a ActionResult.tracked == False.
+        """
+        self.invalidate_snapshot()
+        token = self._exec_command(CALL_JS, scripts_version(), "gTracked", [task_string])
+        if token is False:
+            # w ramce nadal nie ma _g – komenda nie wyszła (zwykłe _g spróbuje jeszcze raz)
+            self._g(task_string)
+        # None – wyjątek: komenda mogła wyjść, więc jej nie powtarzamy
+        if token is False or token is None:
+            token = None
+        return ActionResult(self, token, task_string)
+
+    @contextmanager
+    def batch(self, spacing_ms=0):
+        """
+        Kolejkuje komendy _g wysłane w bloku i wysyła je jednym wywołaniem przy wyjściu:
+            with api.batch():
+                api.loot(); api.take_item(a); api.take_item(b)
+        spacing_ms – odstęp między komendami (w stronie); wyjście z bloku trwa do wysłania ostatniej.
+        Przy wyjątku w bloku nic nie jest wysyłane. Zagnieżdżony batch() dołącza komendy do zewnętrznego.
+        """
+        if self._batch is not None:
+            yield self
+            return
+        self._batch = []
+        try:
+            yield self
+            tasks = self._batch
+        finally:
+            self._batch = None
+        self._g(tasks, spacing_ms=spacing_ms)
+
+    def _send(self, task_string, wait_response):
+        """_g albo _g_tracked – wspólne dla akcji z opcjonalnym potwierdzeniem odpowiedzi."""
+        if wait_response:
+            return self._g_tracked(task_string)
+        self._g(task_string)
+        return None
+
+    def talk_start(self, npc_id, wait_response=False):
+        """Rozpoczęcie rozmowy z NPC: talk&id=ID. wait_response=True – zwraca ActionResult."""
+        return self._send("talk&id=" + str(int(npc_id)), wait_response)
 
     def talk_option(self, npc_id, option_c):
         """Wybór opcji dialogowej: talk&id=ID&c=N."""
         c_str = "" if option_c is None else str(option_c)
-        self.driver.execute_script(
-            "if (typeof _g === 'function') _g('talk&id=' + arguments[0] + '&c=' + encodeURIComponent(arguments[1]));",
-            int(npc_id), c_str,
-        )
+        # quote z tym zestawem znaków bezpiecznych = encodeURIComponent
+        self._g("talk&id=" + str(int(npc_id)) + "&c=" + quote(c_str, safe="-_.!~*'()"))
 
     def talk_cancel(self):
         """Zamknięcie okna dialogu: talk&action=cancel."""
         self._g("talk&action=cancel")
 
-    def fight_attack(self, target_id, fast_fight=True):
+    def fight_attack(self, target_id, fast_fight=True, wait_response=False):
         """
         Atak na potwora/gracza: fight&a=attack&id=ID[&ff=1].
         Dla potworów/NPC serwer oczekuje ujemnego ID. Z ff=1 walka jest od razu szybka,
         bez okna lootu i zamykania – postać musi stać przy NPC.
+        wait_response=True – zwraca ActionResult (odpowiedź serwera na atak).
         """
         aid = int(target_id)
         if aid > 0:
@@ -66,7 +631,7 @@ class MargonemAPI:
         cmd = "fight&a=attack&id=" + str(aid)
         if fast_fight:
             cmd += "&ff=1"
-        self._g(cmd)
+        return self._send(cmd, wait_response)
 
     def fight_fast(self):
         """Szybka walka: fight&a=f&enabled=1 (jak w socket)."""
@@ -80,9 +645,9 @@ class MargonemAPI:
         """Podniesienie lootu po walce. quality=0 wszystko, wyższe=lepsze."""
         self._g("loot&quality=" + str(int(quality)))
 
-    def take_item(self, item_id):
-        """Podniesienie przedmiotu z ziemi: takeitem&id=ID."""
-        self._g("takeitem&id=" + str(item_id))
+    def take_item(self, item_id, wait_response=False):
+        """Podniesienie przedmiotu z ziemi: takeitem&id=ID. wait_response=True – zwraca ActionResult."""
+        return self._send("takeitem&id=" + str(item_id), wait_response)
 
     def move_item(self, item_id, slot):
         """Przeniesienie przedmiotu do slotu: moveitem&id=ID&st=N."""
@@ -92,21 +657,68 @@ class MargonemAPI:
         """Wysłanie poczty: mail&a=send&to=NICK&subj=T&body=B."""
         self._g("mail&a=send&to=" + str(to_nick) + "&subj=" + str(subject) + "&body=" + str(body))
 
-    def shop_buy(self, item_id):
-        """Zakup przedmiotu: shop&buy=ID."""
-        self._g("shop&buy=" + str(item_id))
+    def shop_buy(self, item_id, wait_response=False):
+        """Zakup przedmiotu: shop&buy=ID. wait_response=True – zwraca ActionResult."""
+        return self._send("shop&buy=" + str(item_id), wait_response)
 
     def shop_sell(self, item_id):
         """Sprzedaż przedmiotu: shop&buy=&sell=ID."""
         self._g("shop&buy=&sell=" + str(item_id))
 
+    # --- Migawka świata (jeden execute_script) ---
+
+    def get_snapshot(self, max_age=None):
+        """
+        Spójna migawka stanu gry w jednym wywołaniu execute_script. Zwraca dict:
+        hero {x, y} | None, map {id, name, size_x, size_y}, locks {any, battle, npcdialog, change_location},
+        npcs [{id, x, y, nick}], gateways [{id, x, y}], items [{id, x, y, name}].
+        Wynik jest trzymany przez max_age sekund (domyślnie SNAPSHOT_TTL_SEC) – kolejne wywołania
+        w tym czasie nie odpytują przeglądarki. Akcje (_g, ruch) unieważniają migawkę.
+        Przy błędzie zwraca pusty dict.
+        """
+        ttl = SNAPSHOT_TTL_SEC if max_age is None else max_age
+        if self._snapshot is not None and time.time() - self._snapshot_time <= ttl:
+            return self._snapshot
+        try:
+            snap = self._call("snapshot")
+        except Exception:
+            self.invalidate_snapshot()
+            return {}
+        if not isinstance(snap, dict):
+            if snap is None:
+                # null – w bieżącej ramce nie ma Engine: zapamiętany kontekst jest nieaktualny
+                self.invalidate_context()
+            self.invalidate_snapshot()
+            return {}
+        self._snapshot = snap
+        self._snapshot_time = time.time()
+        return snap
+
+    def invalidate_snapshot(self):
+        """Wymusza odczyt świeżej migawki przy następnym get_snapshot()."""
+        self._snapshot = None
+        self._snapshot_time = 0.0
+
+    def _snapshot_hero_position(self, snap):
+        """(x, y) bohatera z migawki lub None."""
+        hero = (snap or {}).get("hero")
+        if not hero or hero.get("x") is None or hero.get("y") is None:
+            return None
+        return (hero["x"], hero["y"])
+
+    def _snapshot_npc_by_id(self, snap, npc_id):
+        """NPC {id, x, y, nick} o danym ID z migawki lub None."""
+        for n in (snap or {}).get("npcs") or []:
+            if n.get("id") is not None and str(n["id"]) == str(npc_id):
+                return n
+        return None
+
     # --- Hero (Engine.hero) ---
 
     def get_hero_position(self):
         """Zwraca (x, y) bohatera lub None."""
-        self.ensure_context()
         try:
-            r = self.driver.execute_script(
+            r = self._exec(
                 "return (Engine && Engine.hero && Engine.hero.d) "
                 "? { x: Engine.hero.d.x, y: Engine.hero.d.y } : null;"
             )
@@ -116,18 +728,8 @@ class MargonemAPI:
 
     def get_hero_stats(self):
         """Zwraca dict: hp, maxhp, lvl, gold, nick, id, dir, prof (lub częściowo None)."""
-        self.ensure_context()
         try:
-            return self.driver.execute_script(
-                """
-                if (!Engine || !Engine.hero || !Engine.hero.d) return null;
-                var d = Engine.hero.d, ws = d.warrior_stats || {};
-                return {
-                    hp: ws.hp, maxhp: ws.maxhp, lvl: d.lvl, gold: d.gold,
-                    nick: d.nick, id: d.id, dir: d.dir, prof: d.prof
-                };
-                """
-            ) or {}
+            return self._call("heroStats") or {}
         except Exception:
             return {}
 
@@ -154,6 +756,7 @@ class MargonemAPI:
             return None
         try:
             self.driver.switch_to.default_content()
+            mark_default_content(self.driver)
             try:
                 el = self.driver.find_element(
                     "xpath",
@@ -167,7 +770,7 @@ class MargonemAPI:
             pct = find_in_current()
             if pct is not None:
                 return pct
-            if ensure_game_context(self.driver):
+            if self.ensure_context():
                 pct = find_in_current()
                 if pct is not None:
                     return pct
@@ -182,18 +785,8 @@ class MargonemAPI:
         Zwraca dict: visual_hp, visual_maxhp (do wyboru mikstury – ile HP brakuje).
         Używaj get_hp_percent_from_dom() do decyzji „czy leczyć” – tam jest zawsze poprawny %.
         """
-        self.ensure_context()
         try:
-            return self.driver.execute_script(
-                """
-                if (!Engine || !Engine.hero) return null;
-                var data = (typeof Engine.hero.getData === 'function') ? Engine.hero.getData() : Engine.hero.d;
-                if (!data) return null;
-                var visualHP = parseInt(data.hp, 10) || 0;
-                var visualMax = parseInt(data.maxhp, 10) || 1;
-                return { visual_hp: visualHP, visual_maxhp: visualMax };
-                """
-            ) or {}
+            return self._call("heroHpForHeal") or {}
         except Exception:
             return {}
 
@@ -202,23 +795,8 @@ class MargonemAPI:
         Lista mikstur do leczenia z ekwipunku (lokacja "g").
         Każdy element: {id, name, val, type} gdzie type to "heal" (leczy N) lub "full" (fullheal).
         """
-        self.ensure_context()
         try:
-            raw = self.driver.execute_script(
-                """
-                if (!Engine || !Engine.items || typeof Engine.items.fetchLocationItems !== 'function') return [];
-                var raw = Engine.items.fetchLocationItems('g') || [];
-                var res = [];
-                for (var i = 0; i < raw.length; i++) {
-                    var it = raw[i];
-                    var obj = (it.i != null) ? it.i : it;
-                    var s = (obj._cachedStats != null) ? obj._cachedStats : (it._cachedStats || {});
-                    if (s.leczy != null) res.push({ id: obj.id, name: (obj.name || ''), val: parseInt(s.leczy, 10) || 0, type: 'heal' });
-                    if (s.fullheal != null) res.push({ id: obj.id, name: (obj.name || ''), val: 999999, type: 'full' });
-                }
-                return res;
-                """
-            )
+            raw = self._call("healPotions")
             return raw if isinstance(raw, list) else []
         except Exception:
             return []
@@ -269,96 +847,97 @@ class MargonemAPI:
             pots_sorted_asc = sorted(pots, key=lambda p: p.get("val") or 0)
             chosen = pots_sorted_asc[0] if pots_sorted_asc else None
         if chosen:
-            log("AutoHeal: piję {} (moc: {}).".format(chosen.get("name", "?"), chosen.get("val", 0)))
-            self.use_item_to_quick_slot(chosen["id"], slot=1)
+            # kolejne mikstury, dopóki razem nie przekroczą brakującego HP – jedną paczką komend
+            drink = [chosen]
+            healed = chosen.get("val") or 0
+            for p in pots_sorted:
+                if len(drink) >= AUTOHEAL_MAX_POTIONS:
+                    break
+                if p is not chosen and healed + (p.get("val") or 0) <= missing:
+                    drink.append(p)
+                    healed += p.get("val") or 0
+            with self.batch(spacing_ms=AUTOHEAL_POTION_SPACING_MS):
+                for p in drink:
+                    log("AutoHeal: piję {} (moc: {}).".format(p.get("name", "?"), p.get("val", 0)))
+                    self.use_item_to_quick_slot(p["id"], slot=1)
         return True
 
     def hero_auto_go_to(self, x, y):
         """Wysyła bohatera do kratki (x, y). Nie czeka na dojście."""
-        self.ensure_context()
-        self.driver.execute_script(
-            "if (Engine && Engine.hero && Engine.hero.autoGoTo) "
-            "Engine.hero.autoGoTo({ x: arguments[0], y: arguments[1] });",
+        self.invalidate_snapshot()
+        self._exec_command(
+            "if (typeof Engine === 'undefined' || !Engine || !Engine.hero || !Engine.hero.autoGoTo) return false;"
+            " Engine.hero.autoGoTo({ x: arguments[0], y: arguments[1] }); return true;",
             int(x), int(y),
         )
+        self._move_dest = (int(x), int(y))
+        self._move_last_progress = time.time()
+        self.moves_issued += 1
         self.log("Ruch do ({}, {}) rozpoczęty.".format(x, y))
 
+    def move_towards(self, x, y, hero_pos=None, retarget_tiles=MOVE_RETARGET_TILES, stall_sec=MOVE_STALL_SEC):
+        """
+        Jak hero_auto_go_to, ale pomija komendę, gdy bohater już idzie w to miejsce:
+        cel ruchu zmienia się dopiero gdy (x, y) odsunie się od bieżącego celu o więcej niż
+        retarget_tiles albo bohater stoi (brak zmiany hero_pos przez stall_sec / już doszedł).
+        Zwraca True jeśli wysłano autoGoTo. Liczniki: move_stats().
+        """
+        now = time.time()
+        if hero_pos is not None and hero_pos != self._move_last_hero:
+            self._move_last_hero = hero_pos
+            self._move_last_progress = now
+        dest = self._move_dest
+        if (
+            dest is not None
+            and self._distance_manhattan(dest[0], dest[1], x, y) <= retarget_tiles
+            and (hero_pos is None or tuple(hero_pos) != dest)
+            and now - self._move_last_progress < stall_sec
+        ):
+            self.moves_suppressed += 1
+            return False
+        self.hero_auto_go_to(x, y)
+        return True
+
+    def move_stats(self):
+        """Liczniki komend ruchu: issued (wysłane autoGoTo), suppressed (pominięte przez move_towards)."""
+        return {"issued": self.moves_issued, "suppressed": self.moves_suppressed}
+
+    def _expect_walk(self, policy, hero_pos, x, y):
+        """Ustawia w policy ETA dojścia z hero_pos do (x, y) (HERO_TILES_PER_SEC); bez pozycji – brak ETA."""
+        if hero_pos is None:
+            policy.expect(None)
+            return
+        policy.expect(self._distance_manhattan(hero_pos[0], hero_pos[1], x, y) / HERO_TILES_PER_SEC)
+
     # --- Map (Engine.map) ---
 
     def get_map_info(self):
         """Zwraca dict: id, name, size_x, size_y lub pusty dict."""
-        self.ensure_context()
         try:
-            return self.driver.execute_script(
-                """
-                if (!Engine || !Engine.map) return {};
-                var m = Engine.map;
-                return {
-                    id: m.d && m.d.id, name: m.d && m.d.name,
-                    size_x: m.size && m.size.x, size_y: m.size && m.size.y
-                };
-                """
-            ) or {}
+            return self._call("mapInfo") or {}
         except Exception:
             return {}
 
     def get_ground_items(self):
         """Lista przedmiotów na ziemi: [{id, x, y, name}, ...]."""
-        self.ensure_context()
         try:
-            raw = self.driver.execute_script(
-                """
-                var raw = Engine && Engine.map && Engine.map.groundItems
-                    ? Engine.map.groundItems.getDrawableItems() : [];
-                var out = [];
-                for (var i = 0; i < raw.length; i++) {
-                    var o = raw[i];
-                    if (o && o.i) out.push({ id: String(o.i.id), x: o.i.x, y: o.i.y, name: (o.i.name || '') });
-                }
-                return out;
-                """
-            )
+            raw = self._call("groundItems")
             return raw if isinstance(raw, list) else []
         except Exception:
             return []
 
     def get_gateways(self):
         """Lista bram: [{id, x, y}, ...]."""
-        self.ensure_context()
         try:
-            raw = self.driver.execute_script(
-                """
-                var gates = Engine && Engine.map && Engine.map.gateways ? Engine.map.gateways.getList() : [];
-                var out = [];
-                for (var j = 0; j < gates.length; j++) {
-                    var g = gates[j];
-                    if (g && g.d) out.push({ id: g.d.id, x: g.d.x, y: g.d.y });
-                }
-                return out;
-                """
-            )
+            raw = self._call("gateways")
             return raw if isinstance(raw, list) else []
         except Exception:
             return []
 
     def get_float_objects(self):
         """Lista float objects (rośliny, zbieralne): [{id, x, y}, ...]."""
-        self.ensure_context()
         try:
-            raw = self.driver.execute_script(
-                """
-                var list = Engine && Engine.floatObjectManager
-                    ? Engine.floatObjectManager.getDrawableList() : [];
-                var out = [];
-                for (var k = 0; k < list.length; k++) {
-                    var o = list[k];
-                    if (o && o.id != null && (o.x != null || (o.d && o.d.x != null))) {
-                        out.push({ id: o.id, x: o.x != null ? o.x : o.d.x, y: o.y != null ? o.y : o.d.y });
-                    }
-                }
-                return out;
-                """
-            )
+            raw = self._call("floatObjects")
             return raw if isinstance(raw, list) else []
         except Exception:
             return []
@@ -367,96 +946,109 @@ class MargonemAPI:
 
     def get_npcs_list(self):
         """Lista wszystkich NPC na mapie: [{id, x, y, nick}, ...]."""
-        self.ensure_context()
         try:
-            raw = self.driver.execute_script(
-                """
-                var npcs = Engine && Engine.npcs ? Engine.npcs.check() : {};
-                var list = [];
-                for (var id in npcs) {
-                    var n = npcs[id];
-                    if (n && n.d) list.push({ id: n.d.id, x: n.d.x, y: n.d.y, nick: (n.d.nick || '') });
-                }
-                return list;
-                """
-            )
+            raw = self._call("npcsList")
             return raw if isinstance(raw, list) else []
         except Exception:
             return []
 
     def get_npc_by_id(self, npc_id):
         """Zwraca {id, x, y, nick} dla NPC o danym ID lub None."""
-        self.ensure_context()
         try:
-            return self.driver.execute_script(
-                """
-                var id = arguments[0];
-                var npc = (Engine && Engine.npcs && Engine.npcs.getById) ? Engine.npcs.getById(id) : null;
-                if (!npc || !npc.d) return null;
-                return { id: npc.d.id, x: npc.d.x, y: npc.d.y, nick: (npc.d.nick || '') };
-                """,
-                int(npc_id),
-            )
+            return self._call("npcById", int(npc_id))
         except Exception:
             return None
 
-    def find_npcs_by_name(self, name_substring):
+    @property
+    def agent(self):
+        """PageAgent tej instancji – lustro NPC/bohatera/blokad aktualizowane deltami ze strony."""
+        if self._agent is None:
+            self._agent = PageAgent(self)
+        return self._agent
+
+    def get_npcs_live(self):
+        """
+        Lista NPC z lustra agenta (pobiera tylko zmiany od ostatniego odczytu).
+        Gdy agenta nie da się użyć – pełna lista z get_npcs_list().
+        """
+        if self.agent.sync() is None:
+            return self.get_npcs_list()
+        return self.agent.npcs()
+
+    def find_npcs_by_name(self, name_substring, live=False):
         """
         Zwraca listę NPC (i potworów) których nick zawiera name_substring (bez rozróżniania wielkości).
-        Każdy element: {id, x, y, nick}.
+        Każdy element: {id, x, y, nick}. live=True – z lustra agenta (get_npcs_live), do częstych sprawdzeń.
         """
         part = (name_substring or "").strip().lower()
         if not part:
             return []
-        all_npcs = self.get_npcs_list()
+        all_npcs = self.get_npcs_live() if live else self.get_npcs_list()
         return [n for n in all_npcs if part in (n.get("nick") or "").lower()]
 
-    def find_nearest_npc_by_name(self, name_substring):
+    def find_nearest_npcs(self, name_substring, max_count=5):
         """
-        Znajduje najbliższego NPC/potwora o nazwie zawierającej name_substring.
-        Zwraca {id, x, y, nick} lub None. Odległość w metryce Manhattan (kratki).
+        Zwraca do max_count najbliższych NPC/potworów o nazwie zawierającej name_substring,
+        posortowanych rosnąco po odległości (Manhattan). Każdy element: {id, x, y, nick, dist}.
+        Filtrowanie i liczenie odległości odbywa się w stronie – do Pythona trafia tylko wynik.
+        Gdy pomocnik JS zawiedzie – to samo liczone w Pythonie na pełnej liście NPC.
         """
+        part = (name_substring or "").strip().lower()
+        if not part or max_count <= 0:
+            return []
+        try:
+            r = self._call("nearestNpcs", part, int(max_count))
+            if isinstance(r, list):
+                return r
+        except Exception:
+            pass
+        return self._find_nearest_npcs_py(part, max_count)
+
+    def _find_nearest_npcs_py(self, name_substring, max_count):
+        """Wersja Pythonowa find_nearest_npcs (pozycja bohatera + pełna lista NPC)."""
         pos = self.get_hero_position()
         if pos is None:
-            return None
+            return []
         hx, hy = pos
-        candidates = self.find_npcs_by_name(name_substring)
-        if not candidates:
-            return None
-        best = None
-        best_dist = float("inf")
-        for n in candidates:
-            dx = abs(n["x"] - hx)
-            dy = abs(n["y"] - hy)
-            d = dx + dy
-            if d < best_dist:
-                best_dist = d
-                best = n
-        return best
+        out = []
+        for n in self.find_npcs_by_name(name_substring):
+            n = dict(n)
+            n["dist"] = self._distance_manhattan(hx, hy, n["x"], n["y"])
+            out.append(n)
+        out.sort(key=lambda n: n["dist"])
+        return out[:max_count]
+
+    def find_nearest_npc_by_name(self, name_substring):
+        """
+        Znajduje najbliższego NPC/potwora o nazwie zawierającej name_substring.
+        Zwraca {id, x, y, nick, dist} lub None. Odległość w metryce Manhattan (kratki).
+        """
+        found = self.find_nearest_npcs(name_substring, max_count=1)
+        return found[0] if found else None
 
     def wait_for_entity_respawn_while_wandering(
         self,
         name_substring,
-        check_interval=0.5,
         single_walk_timeout_sec=8,
         cancel_check=None,
         pause_check=None,
+        policy=None,
     ):
         """
         Czeka, aż na mapie pojawią się znowu postacie o nazwie zawierającej name_substring.
         W międzyczasie chodzi losowo po mapie (nie stoi w miejscu).
         cancel_check: callable() -> True aby przerwać (np. lambda: ev.is_set()).
         pause_check: callable() -> True gdy pauza (wtedy tylko czeka).
+        policy: PollingPolicy (domyślnie polling_policy()).
         Zwraca True gdy cele są na mapie, False gdy anulowano.
         """
+        policy = policy or self.polling_policy()
         while True:
             if cancel_check and cancel_check():
                 return False
-            while pause_check and pause_check():
-                time.sleep(0.3)
-                if cancel_check and cancel_check():
-                    return False
-            mobs = self.find_npcs_by_name(name_substring)
+            if not wait_while_paused(pause_check, cancel_check):
+                return False
+            mobs = self.find_npcs_by_name(name_substring, live=True)
             if mobs:
                 self.log("Pojawiły się cele ({} szt.) – wznawiam atak.".format(len(mobs)))
                 return True
@@ -472,45 +1064,48 @@ class MargonemAPI:
                 rx = max(0, pos[0] + random.randint(-4, 4))
                 ry = max(0, pos[1] + random.randint(-4, 4))
             else:
-                time.sleep(check_interval)
+                policy.sleep(False)
                 continue
             if not self.can_act():
-                time.sleep(check_interval)
+                policy.sleep(False)
                 continue
             self.hero_auto_go_to(rx, ry)
+            policy.reset()
+            self._expect_walk(policy, pos, rx, ry)
             deadline = time.time() + single_walk_timeout_sec
+            walk = _WalkProgress(pos)
             while time.time() < deadline:
                 if cancel_check and cancel_check():
                     return False
-                while pause_check and pause_check():
-                    time.sleep(0.3)
-                    if cancel_check and cancel_check():
-                        return False
-                mobs = self.find_npcs_by_name(name_substring)
+                if not wait_while_paused(pause_check, cancel_check):
+                    return False
+                mobs = self.find_npcs_by_name(name_substring, live=True)
                 if mobs:
                     self.log("Pojawiły się cele – wznawiam atak.")
                     return True
                 pos = self.get_hero_position()
                 if pos and self._distance_manhattan(pos[0], pos[1], rx, ry) <= 2:
                     break
-                time.sleep(check_interval)
-            time.sleep(0.3)
+                if walk.stalled(pos):
+                    break
+                policy.sleep(False, deadline=deadline)
+            policy.sleep(False)
 
     def wander_randomly_for_seconds(
-        self, seconds, check_interval=0.5, cancel_check=None, pause_check=None
+        self, seconds, cancel_check=None, pause_check=None, policy=None
     ):
         """
         Chodzi losowo po aktualnej mapie przez podaną liczbę sekund.
         Przerywa gdy cancel_check() == True. Pauza: pause_check() – wtedy tylko czeka.
+        policy: PollingPolicy (domyślnie polling_policy()).
         """
+        policy = policy or self.polling_policy()
         deadline = time.time() + seconds
         while time.time() < deadline:
             if cancel_check and cancel_check():
                 return
-            while pause_check and pause_check():
-                time.sleep(0.3)
-                if cancel_check and cancel_check():
-                    return
+            if not wait_while_paused(pause_check, cancel_check):
+                return
             mi = self.get_map_info()
             sx, sy = mi.get("size_x"), mi.get("size_y")
             pos = self.get_hero_position()
@@ -521,25 +1116,28 @@ class MargonemAPI:
                 rx = max(0, pos[0] + random.randint(-4, 4))
                 ry = max(0, pos[1] + random.randint(-4, 4))
             else:
-                time.sleep(check_interval)
+                policy.sleep(False, deadline=deadline)
                 continue
             if not self.can_act():
-                time.sleep(check_interval)
+                policy.sleep(False, deadline=deadline)
                 continue
             self.hero_auto_go_to(rx, ry)
+            policy.reset()
+            self._expect_walk(policy, pos, rx, ry)
             step_deadline = time.time() + min(8, max(0, deadline - time.time()))
+            walk = _WalkProgress(pos)
             while time.time() < step_deadline:
                 if cancel_check and cancel_check():
                     return
-                while pause_check and pause_check():
-                    time.sleep(0.3)
-                    if cancel_check and cancel_check():
-                        return
+                if not wait_while_paused(pause_check, cancel_check):
+                    return
                 pos = self.get_hero_position()
                 if pos and self._distance_manhattan(pos[0], pos[1], rx, ry) <= 2:
                     break
-                time.sleep(check_interval)
-            time.sleep(0.3)
+                if walk.stalled(pos):
+                    break
+                policy.sleep(False, deadline=step_deadline)
+            policy.sleep(False, deadline=deadline)
 
     # --- Locks (Engine.lock) ---
 
@@ -548,11 +1146,10 @@ class MargonemAPI:
         lock_type=None: True jeśli jakakolwiek blokada.
         lock_type="battle"|"npcdialog"|"change_location"|"logoff": sprawdza konkretną blokadę.
         """
-        self.ensure_context()
         try:
             if lock_type is None:
-                return self.driver.execute_script("return Engine && Engine.lock && Engine.lock.check();")
-            return self.driver.execute_script(
+                return self._exec("return Engine && Engine.lock && Engine.lock.check();")
+            return self._exec(
                 "return Engine && Engine.lock && Engine.lock.check(arguments[0]);",
                 lock_type,
             )
@@ -561,26 +1158,56 @@ class MargonemAPI:
 
     def can_act(self):
         """True jeśli nie ma blokady walki ani dialogu (można iść / atakować / rozmawiać)."""
-        return not self.is_locked("battle") and not self.is_locked("npcdialog")
+        return self._snapshot_can_act(self.get_snapshot())
+
+    def _snapshot_can_act(self, snap):
+        """Jak can_act(), ale na podstawie podanej migawki."""
+        locks = (snap or {}).get("locks") or {}
+        return not locks.get("battle") and not locks.get("npcdialog")
+
+    def wait_until_battle_ends(self, timeout_sec=BATTLE_TIMEOUT_SEC, in_page=True, policy=None):
+        """
+        Czeka aż blokada walki (Engine.lock.check('battle')) zniknie. Zwraca True jeśli walka się skończyła.
+        in_page=True: czeka w stronie (execute_async_script) – wraca od razu po zdjęciu blokady;
+        gdy driver tego nie obsługuje, odpytuje według policy (ETA: BATTLE_END_ETA_SEC).
+        """
+        if self._wait_battle_lock(False, timeout_sec, in_page, policy):
+            self.log("Walka zakończona.")
+            return True
+        self.log("Timeout oczekiwania na zakończenie walki.")
+        return False
 
-    def wait_until_battle_ends(self, timeout_sec=60, check_interval=0.4):
-        """Czeka aż blokada walki (Engine.lock.check('battle')) zniknie. Zwraca True jeśli walka się skończyła."""
+    def wait_until_battle_starts(self, timeout_sec=BATTLE_START_WAIT_SEC, in_page=True, policy=None):
+        """Czeka aż pojawi się blokada walki. Zwraca True gdy walka trwa, False po timeout_sec."""
+        return self._wait_battle_lock(True, timeout_sec, in_page, policy)
+
+    def _wait_battle_lock(self, locked, timeout_sec, in_page, policy):
+        """Czeka, aż blokada walki będzie w stanie locked (w stronie albo odpytując); True gdy tak."""
         deadline = time.time() + timeout_sec
+        if in_page:
+            kind = "battle_start" if locked else "battle_end"
+            while time.time() < deadline:
+                r = self._wait_in_page(kind, None, min(IN_PAGE_WAIT_SLICE_SEC, deadline - time.time()))
+                if r is None:
+                    break
+                if r.get("met"):
+                    return True
+            else:
+                return False
+        policy = policy or self.polling_policy()
+        policy.expect(min(BATTLE_END_ETA_SEC, timeout_sec))
         while time.time() < deadline:
-            if not self.is_locked("battle"):
-                self.log("Walka zakończona.")
+            if self.is_locked("battle") == locked:
                 return True
-            time.sleep(check_interval)
-        self.log("Timeout oczekiwania na zakończenie walki.")
+            policy.sleep(False, deadline=deadline)
         return False
 
     # --- Communication ---
 
     def get_full_data_package(self):
         """Ostatni pakiet JSON z serwera (do parsowania dialogów, lootu, błędów)."""
-        self.ensure_context()
         try:
-            return self.driver.execute_script(
+            return self._exec(
                 "return (Engine && Engine.communication && Engine.communication.getFullDataPackage) "
                 "? Engine.communication.getFullDataPackage() : null;"
             )
@@ -589,10 +1216,11 @@ class MargonemAPI:
 
     def send2(self, task_string):
         """Wysłanie komendy z pominięciem kolejki: Engine.communication.send2(task)."""
-        self.ensure_context()
-        self.driver.execute_script(
-            "if (Engine && Engine.communication && Engine.communication.send2) "
-            "Engine.communication.send2(arguments[0]);",
+        self.invalidate_snapshot()
+        self._exec_command(
+            "if (typeof Engine === 'undefined' || !Engine || !Engine.communication"
+            " || !Engine.communication.send2) return false;"
+            " Engine.communication.send2(arguments[0]); return true;",
             task_string,
         )
 
@@ -607,11 +1235,12 @@ class MargonemAPI:
             return False
         try:
             r = self.captcha_check(self.driver)
-            self.ensure_context()
             return r == "skipped_tries"
         except Exception:
-            self.ensure_context()
             return False
+        finally:
+            # captcha_solver przełącza na default_content (mark_default_content) – wracamy do ramki gry
+            self.ensure_context()
 
     def go_to_xy(self, x, y):
         """Wysyła bohatera do (x, y). Nie czeka."""
@@ -624,16 +1253,27 @@ class MargonemAPI:
         distance=1,
         timeout_sec=120,
         stuck_no_move_sec=25,
-        check_interval=0.4,
+        in_page=True,
+        policy=None,
     ):
         """
         Czeka aż bohater będzie w odległości <= distance (Manhattan) od (target_x, target_y).
         Timeout tylko gdy: postać nie rusza się przez stuck_no_move_sec (utknęła)
         albo upłynie łącznie timeout_sec. Dopóki postać zmienia pozycję, czekamy.
+        in_page=True: czeka w stronie (execute_async_script) i wraca od razu po dojściu;
+        gdy driver tego nie obsługuje, odpytuje według policy (ETA z odległości i HERO_TILES_PER_SEC).
         """
+        policy = policy or self.polling_policy()
+        if in_page:
+            r = self._wait_until_near_in_page(
+                target_x, target_y, distance, timeout_sec, stuck_no_move_sec, policy
+            )
+            if r is not None:
+                return r
         start = time.time()
         last_pos = None
         last_move_time = time.time()
+        stalled = False
         while True:
             if self._maybe_solve_captcha():
                 self.log("Przerwano (zagadka – za mało prób).")
@@ -642,20 +1282,61 @@ class MargonemAPI:
             if elapsed >= timeout_sec:
                 self.log("Timeout: przekroczono łączny czas {} s.".format(timeout_sec))
                 return False
-            pos = self.get_hero_position()
+            pos = self._snapshot_hero_position(self.get_snapshot())
             if pos is None:
-                time.sleep(check_interval)
+                policy.sleep(False)
                 continue
             if self._distance_manhattan(pos[0], pos[1], target_x, target_y) <= distance:
                 self.log("Dojście do ({}, {}) – pozycja ({}, {}).".format(target_x, target_y, pos[0], pos[1]))
                 return True
-            if last_pos is None or (pos[0], pos[1]) != (last_pos[0], last_pos[1]):
+            moved = last_pos is None or (pos[0], pos[1]) != (last_pos[0], last_pos[1])
+            if moved:
                 last_move_time = time.time()
                 last_pos = pos
+                # postęp marszu to nie zdarzenie – tylko nowe ETA; gęściej dopiero przy dojściu
+                self._expect_walk(policy, pos, target_x, target_y)
+            if time.time() - last_move_time >= stuck_no_move_sec:
+                self.log("Postać utknęła (brak ruchu od {} s) – przerywam.".format(stuck_no_move_sec))
+                return False
+            # zatrzymanie (brak ruchu od MOVE_STALL_SEC) – jednorazowo wracamy do częstych sprawdzeń
+            was_stalled = stalled
+            stalled = not moved and time.time() - last_move_time >= MOVE_STALL_SEC
+            policy.sleep(stalled and not was_stalled, deadline=start + timeout_sec)
+
+    def _wait_until_near_in_page(self, target_x, target_y, distance, timeout_sec, stuck_no_move_sec, policy):
+        """wait_until_near w wycinkach _wait_in_page. None gdy pierwszy wycinek się nie udał (fallback)."""
+        start = time.time()
+        last_move_time = start
+        first = True
+        params = {"x": int(target_x), "y": int(target_y), "distance": distance}
+        while True:
+            if self._maybe_solve_captcha():
+                self.log("Przerwano (zagadka – za mało prób).")
+                return False
+            now = time.time()
+            if now - start >= timeout_sec:
+                self.log("Timeout: przekroczono łączny czas {} s.".format(timeout_sec))
+                return False
+            slice_sec = min(
+                IN_PAGE_WAIT_SLICE_SEC,
+                timeout_sec - (now - start),
+                max(0.05, stuck_no_move_sec - (now - last_move_time)),
+            )
+            r = self._wait_in_page("near", params, slice_sec)
+            if r is None:
+                if first:
+                    return None
+                policy.sleep(False)
+                continue
+            first = False
+            if r.get("met"):
+                self.log("Dojście do ({}, {}) – pozycja ({}, {}).".format(target_x, target_y, r.get("x"), r.get("y")))
+                return True
+            if r.get("moved"):
+                last_move_time = time.time() - (r.get("idle_ms") or 0) / 1000.0
             if time.time() - last_move_time >= stuck_no_move_sec:
                 self.log("Postać utknęła (brak ruchu od {} s) – przerywam.".format(stuck_no_move_sec))
                 return False
-            time.sleep(check_interval)
 
     def _normalize_map_id(self, mid):
         """ID mapy do porównania (int lub string)."""
@@ -673,13 +1354,33 @@ class MargonemAPI:
             return None
         return mi.get("id")
 
-    def wait_for_map_change(self, target_map_id, timeout_sec=15, check_interval=0.4):
+    def wait_for_map_change(self, target_map_id, timeout_sec=15, in_page=True, policy=None):
         """
         Czeka aż postać zmieni mapę na target_map_id (porównanie po id).
         Zwraca True gdy mapa się zmieni, False przy timeout.
+        in_page=True: czeka w stronie (execute_async_script) i wraca od razu po zmianie mapy;
+        gdy driver tego nie obsługuje, odpytuje według policy (ETA: MAP_CHANGE_ETA_SEC).
         """
         target = self._normalize_map_id(target_map_id)
         deadline = time.time() + timeout_sec
+        if in_page and target is not None:
+            while time.time() < deadline:
+                if self._maybe_solve_captcha():
+                    self.log("Przerwano (zagadka – za mało prób).")
+                    return False
+                r = self._wait_in_page(
+                    "map", {"id": int(target)}, min(IN_PAGE_WAIT_SLICE_SEC, deadline - time.time())
+                )
+                if r is None:
+                    break
+                if r.get("met"):
+                    self.log("Zmiana mapy – jesteśmy na docelowej mapie (ID: {}).".format(target))
+                    return True
+            else:
+                self.log("Timeout: brak zmiany mapy na ID {}.".format(target_map_id))
+                return False
+        policy = policy or self.polling_policy()
+        policy.expect(min(MAP_CHANGE_ETA_SEC, timeout_sec))
         while time.time() < deadline:
             if self._maybe_solve_captcha():
                 self.log("Przerwano (zagadka – za mało prób).")
@@ -688,29 +1389,66 @@ class MargonemAPI:
             if current is not None and target is not None and int(current) == int(target):
                 self.log("Zmiana mapy – jesteśmy na docelowej mapie (ID: {}).".format(target))
                 return True
-            time.sleep(check_interval)
+            policy.sleep(False, deadline=deadline)
         self.log("Timeout: brak zmiany mapy na ID {}.".format(target_map_id))
         return False
 
-    def go_to_gateway_and_enter(self, gateway_id, target_map_id, move_timeout_sec=25, map_change_timeout_sec=15):
+    def go_to_gateway_and_enter(
+        self, gateway_id, target_map_id, move_timeout_sec=25, map_change_timeout_sec=15, current_map_id=None,
+        entry_gateway_id=None,
+    ):
         """
         Idzie do bramy o danym ID na aktualnej mapie, wchodzi (kratka od bramy) i czeka na zmianę mapy.
         gateway_id: id bramy z Engine.map.gateways (może int lub string).
         target_map_id: oczekiwane ID mapy po wejściu.
+        current_map_id: ID bieżącej mapy, gdy wiadomo (np. zaraz po przejściu) – pozycja bramy
+        jest wtedy brana z gateway_cache bez migawki; gdy nieaktualna, odświeżana z gry.
+        entry_gateway_id: brama, którą bohater właśnie wszedł na bieżącą mapę i przy której stoi
+        (tylko przy kolejnych przejściach jednej trasy). Wtedy czas od wyruszenia do zmiany mapy
+        trafia do travel_times (mapa, brama wejściowa, brama wyjściowa); po innym ruchu pomiar
+        nie odpowiadałby żadnemu odcinkowi, więc nie jest zapisywany.
         Zwraca True jeśli udało się wejść na docelową mapę.
         """
-        gateways = self.get_gateways()
         gw_id_norm = int(gateway_id) if gateway_id is not None else None
-        gate = None
+        current = self._normalize_map_id(current_map_id)
+        pos = get_gateway_pos(current, gw_id_norm) if current is not None else None
+        from_cache = pos is not None
+        if not from_cache:
+            current, pos = self._find_gateway(gw_id_norm)
+            if pos is None:
+                self.log("Brak bramy o ID {} na obecnej mapie.".format(gateway_id))
+                return False
+        started = time.time()
+        ok = self._walk_through_gateway(pos, gateway_id, target_map_id, move_timeout_sec, map_change_timeout_sec)
+        if not ok and from_cache:
+            fresh_map, fresh_pos = self._find_gateway(gw_id_norm)
+            if fresh_pos is not None and fresh_pos != pos and str(fresh_map) == str(current):
+                self.log("Brama {} ma inne współrzędne niż zapamiętane – ponawiam.".format(gateway_id))
+                started = time.time()
+                ok = self._walk_through_gateway(
+                    fresh_pos, gateway_id, target_map_id, move_timeout_sec, map_change_timeout_sec
+                )
+        if not ok:
+            return False
+        self._map_visit = None  # każde przejście to nowa wizyta, także powrót na tę samą mapę
+        if current is not None and entry_gateway_id is not None:
+            record_travel(current, entry_gateway_id, gw_id_norm, time.time() - started)
+        return True
+
+    def _find_gateway(self, gateway_id):
+        """Świeża migawka: (ID bieżącej mapy, (x, y) bramy gateway_id | None); uczy geometrii mapy."""
+        snap = self.get_snapshot(max_age=0) or {}
+        current = self._normalize_map_id((snap.get("map") or {}).get("id"))
+        gateways = snap.get("gateways") or self.get_gateways()
+        self.learn_map_geometry(snap, gateways)
         for g in gateways:
             gid = g.get("id")
-            if gid is not None and int(gid) == gw_id_norm:
-                gate = g
-                break
-        if not gate:
-            self.log("Brak bramy o ID {} na obecnej mapie.".format(gateway_id))
-            return False
-        gx, gy = gate.get("x"), gate.get("y")
+            if gid is not None and int(gid) == gateway_id:
+                return current, (g.get("x"), g.get("y"))
+        return current, None
+
+    def _walk_through_gateway(self, pos, gateway_id, target_map_id, move_timeout_sec, map_change_timeout_sec):
+        gx, gy = pos
         self.log("Przejście przez bramę {} do mapy {} – idę do ({}, {}).".format(gateway_id, target_map_id, gx, gy))
         self.hero_auto_go_to(gx, gy)
         if not self.wait_until_near(
@@ -719,29 +1457,117 @@ class MargonemAPI:
             return False
         return self.wait_for_map_change(target_map_id, timeout_sec=map_change_timeout_sec)
 
+    def learn_map_geometry(self, snap=None, gateways=None):
+        """
+        Przekazuje bramy i rozmiar bieżącej mapy do planera tras (maps_graph.record_map_geometry),
+        do gateway_cache (zapis na dysku przy pierwszej wizycie / zmianie) i uzgadnia je z grafem
+        map (maps_graph.observe_gateways – brakujące i martwe przejścia trafiają do nakładki).
+        W trakcie zmiany mapy (blokada change_location) nic nie jest zapisywane – lista bram
+        może być jeszcze z poprzedniej mapy.
+        """
+        snap = snap if snap is not None else (self.get_snapshot() or {})
+        m = snap.get("map") or {}
+        if m.get("id") is None or (snap.get("locks") or {}).get("change_location"):
+            return
+        if self._map_visit is None or str(self._map_visit[0]) != str(m["id"]):
+            # nowa wizyta: znacznik czasu – unikalny także między sesjami (liczniki w nakładce)
+            self._map_visit = (m["id"], time.time())
+        gateways = gateways if gateways is not None else snap.get("gateways")
+        record_map_geometry(m["id"], gateways, m.get("size_x"), m.get("size_y"))
+        try:
+            remember_gateways(m["id"], gateways, m.get("size_x"), m.get("size_y"))
+        except Exception:
+            pass
+        try:
+            diff = observe_gateways(m["id"], gateways, visit=self._map_visit[1])
+        except Exception:
+            diff = None
+        if diff:
+            added, dead = diff
+            self.log("Graf map poprawiony dla mapy {}: nowe przejścia {}, nieistniejące {}.".format(
+                m["id"], ", ".join(added) or "-", ", ".join(dead) or "-"))
+
+    def travel_to_map(self, target_map_id, move_timeout_sec=25, map_change_timeout_sec=15):
+        """
+        Idzie na mapę target_map_id trasą o najmniejszym szacowanym czasie (maps_graph.plan_route).
+        Trasa jest planowana od nowa na każdej mapie. Na mapach, których bramy są już znane
+        (gateway_cache), po zmianie mapy od razu rusza do następnej bramy – bez migawki; bohater
+        stoi wtedy przy bramie wejściowej (ID poprzedniej mapy). Zwraca True po dojściu na mapę docelową.
+        """
+        target = self._normalize_map_id(target_map_id)
+        max_hops = None
+        hops = 0
+        known = None  # (ID mapy, pozycja bohatera) po udanym przejściu na mapę o znanych bramach
+        entry = None  # brama wejściowa bieżącej mapy (ID poprzedniej mapy) – tylko po przejściu tej trasy
+        while True:
+            if known is not None:
+                current, hero_pos = known
+            else:
+                snap = self.get_snapshot(max_age=0) or {}
+                current = self._normalize_map_id((snap.get("map") or {}).get("id"))
+                if current is None:
+                    self.log("Nie odczytano obecnej mapy – przerywam nawigację.")
+                    return False
+                self.learn_map_geometry(snap)
+                hero_pos = self._snapshot_hero_position(snap)
+            if str(current) == str(target):
+                return True
+            path = plan_route(current, target, start_pos=hero_pos)
+            if not path:
+                self.log("Brak ścieżki z mapy {} do {}.".format(current, target_map_id))
+                return False
+            if max_hops is None:
+                max_hops = 2 * len(path) + 5
+                self.log("Trasa do mapy {}: {} przejść.".format(target_map_id, len(path)))
+            if hops >= max_hops:
+                self.log("Nawigacja przerwana – przekroczono {} przejść.".format(max_hops))
+                return False
+            gateway_id, next_map_id = path[0]
+            if not self.go_to_gateway_and_enter(
+                gateway_id, next_map_id,
+                move_timeout_sec=move_timeout_sec,
+                map_change_timeout_sec=map_change_timeout_sec,
+                current_map_id=current,
+                entry_gateway_id=entry,
+            ):
+                self.log("Nawigacja przerwana na kroku {} (brama {} -> mapa {}).".format(hops + 1, gateway_id, next_map_id))
+                return False
+            hops += 1
+            # brama wejściowa na nowej mapie ma ID mapy, z której przyszliśmy
+            entry = current
+            next_map = self._normalize_map_id(next_map_id)
+            known = (next_map, get_gateway_pos(next_map, current)) if has_map(next_map) else None
+
     def navigate_to_map(self, path, move_timeout_sec=25, map_change_timeout_sec=15):
         """
         Wykonuje ścieżkę między mapami. path = [(gateway_id, target_map_id), ...] (wynik BFS).
-        Dla każdego kroku: sprawdza aktualną mapę; jeśli już na docelowej – koniec;
-        w przeciwnym razie idzie do bramy, wchodzi i czeka na zmianę mapy.
+        Dla każdego kroku: jeśli już na mapie docelowej – krok pominięty; w przeciwnym razie
+        idzie do bramy, wchodzi i czeka na zmianę mapy. Aktualna mapa czytana z gry tylko przed
+        pierwszym krokiem – po udanym przejściu to mapa potwierdzona przez wait_for_map_change.
         Zwraca True jeśli dotarł do ostatniej mapy z path.
         """
+        entry = None
+        current = self._normalize_map_id(self.get_current_map_id()) if path else None
         for i, (gateway_id, target_map_id) in enumerate(path):
-            current = self._normalize_map_id(self.get_current_map_id())
             target = self._normalize_map_id(target_map_id)
             if current is not None and target is not None and int(current) == int(target):
                 self.log("Już na mapie docelowej (krok {}/{}).".format(i + 1, len(path)))
+                entry = None
                 continue
             if not self.go_to_gateway_and_enter(
                 gateway_id, target_map_id,
                 move_timeout_sec=move_timeout_sec,
                 map_change_timeout_sec=map_change_timeout_sec,
+                current_map_id=current,
+                entry_gateway_id=entry,
             ):
                 self.log("Nawigacja przerwana na kroku {} (brama {} -> mapa {}).".format(i + 1, gateway_id, target_map_id))
                 return False
+            entry = current
+            current = target
         return True
 
-    def _go_to_entity_and_do(self, name_substring, action_name, do_callback, timeout_sec=30, check_interval=0.5):
+    def _go_to_entity_and_do(self, name_substring, action_name, do_callback, timeout_sec=30, policy=None):
         """
         Wspólna logika: znajdź najbliższego NPC po nazwie, idź do niego sprawdzając co chwilę pozycję,
         gdy postać będzie kratkę od celu – wykonaj do_callback(npc_dict).
@@ -755,41 +1581,66 @@ class MargonemAPI:
             return False
         tx, ty = target["x"], target["y"]
         self.log("Cel: {} (id={}) na ({}, {}). {}".format(target.get("nick"), target["id"], tx, ty, action_name))
+        policy = policy or self.polling_policy()
+        last_pos = None
         deadline = time.time() + timeout_sec
         while time.time() < deadline:
             if self._maybe_solve_captcha():
                 self.log("Przerwano (zagadka – za mało prób).")
                 return False
-            if not self.can_act():
-                time.sleep(check_interval)
+            # Jedna migawka na iterację: blokady, pozycja bohatera i celu z tej samej chwili
+            snap = self.get_snapshot()
+            if not self._snapshot_can_act(snap):
+                policy.sleep(False, deadline=deadline)
                 continue
-            pos = self.get_hero_position()
+            pos = self._snapshot_hero_position(snap)
             if pos is None:
-                time.sleep(check_interval)
+                policy.sleep(False, deadline=deadline)
                 continue
-            if self._distance_manhattan(pos[0], pos[1], tx, ty) <= 1:
-                self.log("W zasięgu – wykonuję: {}.".format(action_name))
-                do_callback(target)
-                return True
-            # Odśwież pozycję celu i sprawdź, czy cel nadal jest na mapie (mógł zostać zabity)
-            t = self.get_npc_by_id(target["id"])
+            # Sprawdź, czy cel nadal jest na mapie (mógł zostać zabity) i odśwież jego pozycję
+            t = self._snapshot_npc_by_id(snap, target["id"])
             if t is None:
                 self.log("Cel '{}' zniknął z mapy (zabity?) – przerywam.".format(name_substring))
                 return False
+            target_moved = (t["x"], t["y"]) != (tx, ty)
+            target = t
             tx, ty = t["x"], t["y"]
-            self.hero_auto_go_to(tx, ty)
-            time.sleep(check_interval)
+            if self._distance_manhattan(pos[0], pos[1], tx, ty) <= 1:
+                self.log("W zasięgu – wykonuję: {}.".format(action_name))
+                do_callback(target)
+                return True
+            issued = self.move_towards(tx, ty, hero_pos=pos)
+            moved = pos != last_pos
+            last_pos = pos
+            if issued or moved or target_moved:
+                self._expect_walk(policy, pos, tx, ty)
+            # zdarzenia: nowa komenda ruchu albo cel się przesunął; sam marsz bohatera – nie
+            policy.sleep(issued or target_moved, deadline=deadline)
         self.log("Timeout przed wykonaniem: {}.".format(action_name))
         return False
 
     def attack_entity_by_name(self, name_substring, timeout_sec=30, fast_fight=True, cooldown_after_attack_sec=3):
         """
         Znajdź najbliższą postać o nazwie zawierającej name_substring, podejdź na kratkę;
-        gdy w zasięgu – atak z ff=1. Po ataku czeka cooldown_after_attack_sec (domyślnie 3 s).
+        gdy w zasięgu – atak z ff=1. Po ataku czeka na odpowiedź serwera (najwyżej
+        cooldown_after_attack_sec, domyślnie 3 s), potem krótko na start walki (blokada albo
+        pakiet walki "f" w odpowiedzi) i na jej koniec (BATTLE_TIMEOUT_SEC). Gdy walka się nie
+        zaczęła albo odpowiedzi nie da się śledzić – czeka resztę cooldown_after_attack_sec.
         """
         def do_attack(npc):
-            self.fight_attack(npc["id"], fast_fight=fast_fight)
-            time.sleep(cooldown_after_attack_sec)
+            deadline = time.time() + cooldown_after_attack_sec
+            res = self.fight_attack(npc["id"], fast_fight=fast_fight, wait_response=True)
+            reply = res.wait(cooldown_after_attack_sec)
+            if reply is None:
+                time.sleep(max(0.0, deadline - time.time()))
+                return
+            if not reply.get("ok"):
+                self.log("Atak: serwer zwrócił błąd ({}).".format(reply.get("e")))
+                return
+            if "f" in (reply.get("keys") or []) or self.wait_until_battle_starts():
+                self.wait_until_battle_ends()
+                return
+            time.sleep(max(0.0, deadline - time.time()))
         return self._go_to_entity_and_do(
             name_substring, "atak", do_attack,
             timeout_sec=timeout_sec,
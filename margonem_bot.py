@@ -13,15 +13,26 @@ import uuid
 
 import config_credentials as creds
 from margonem_api import MargonemAPI
+from polling import wait_while_paused
 from maps_graph import (
     find_map_ids_by_name,
     bfs_path,
+    estimate_route_sec,
     get_map_name_by_id,
     get_maps_with_npc,
     get_maps_with_npc_by_distance,
+    find_hunting_grounds,
     get_neighbor_map_ids,
+    graph_report,
+    is_reachable,
+    plan_route,
+    travel_times_from,
+    TourPlanner,
+    warm_up as warm_up_maps,
+    watch_maps,
 )
 from captcha_solver import check_and_solve_captcha_once, ensure_no_captcha
+from travel_times import flush_travel_times
 
 # Import przeglądarki dopiero przy uruchomieniu
 _driver = None
@@ -34,6 +45,9 @@ XPATH_INPUT_LOGIN = "/html/body/div[3]/div/div[1]/div/div[2]/div[1]/form/div[1]/
 XPATH_INPUT_HASLO = "/html/body/div[3]/div/div[1]/div/div[2]/div[1]/form/div[2]/input"
 XPATH_BUTTON_ZALOGUJ = "/html/body/div[3]/div/div[1]/div/div[2]/div[1]/form/button"
 
+# „Szukaj łowisk” bez podanych poziomów: poziom bohatera ± tyle.
+HUNT_LEVEL_SPAN = 5
+
 
 def _human_delay(min_s=0.3, max_s=0.8):
     time.sleep(random.uniform(min_s, max_s))
@@ -216,6 +230,8 @@ class MainWindow:
         self.root.minsize(500, 400)
         self._build()
         self.root.protocol("WM_DELETE_WINDOW", self._on_close)
+        # Podmieniony margonem_maps_final.json wczytuje się w tle, bez restartu bota
+        watch_maps(log_callback=lambda m: self.root.after(0, lambda msg=m: self._log_append(msg)))
 
     def _log_append(self, msg):
         self._log.config(state=tk.NORMAL)
@@ -283,6 +299,7 @@ class MainWindow:
         self._processes = {}  # process_id -> {name, cancel, pause, target_map_id, target_map_name, enemy_name, attack_loop}
         self._process_queue = []  # kolejka process_id (tylko ataki)
         self._current_process_id = None  # aktualnie wykonywany (gwiazdka)
+        self._tour = TourPlanner()  # kolejność kolejki ataków – najkrótsza łączna trasa
 
         paned = ttk.PanedWindow(parent, orient=tk.HORIZONTAL)
         paned.pack(fill=tk.BOTH, expand=True)
@@ -345,6 +362,15 @@ class MainWindow:
         self._debug_attack_name_var = tk.StringVar(value="Szczur")
         ttk.Entry(row_atk, textvariable=self._debug_attack_name_var, width=20).pack(side=tk.LEFT, padx=(0, 8))
         ttk.Button(row_atk, text="Szukaj map", command=self._debug_attack_search_maps).pack(side=tk.LEFT, padx=(0, 12))
+        row_lvl = ttk.Frame(body3)
+        row_lvl.pack(fill=tk.X, pady=(4, 0))
+        ttk.Label(row_lvl, text="Poziom od:").pack(side=tk.LEFT, padx=(0, 6))
+        self._debug_hunt_lvl_min_var = tk.StringVar(value="")
+        ttk.Entry(row_lvl, textvariable=self._debug_hunt_lvl_min_var, width=5).pack(side=tk.LEFT, padx=(0, 6))
+        ttk.Label(row_lvl, text="do:").pack(side=tk.LEFT, padx=(0, 6))
+        self._debug_hunt_lvl_max_var = tk.StringVar(value="")
+        ttk.Entry(row_lvl, textvariable=self._debug_hunt_lvl_max_var, width=5).pack(side=tk.LEFT, padx=(0, 8))
+        ttk.Button(row_lvl, text="Szukaj łowisk", command=self._debug_attack_search_grounds).pack(side=tk.LEFT, padx=(0, 12))
         self._debug_attack_loop_var = tk.BooleanVar(value=False)
         ttk.Checkbutton(body3, text="Bij w pętli", variable=self._debug_attack_loop_var).pack(anchor=tk.W, pady=(4, 0))
         atk_scroll_f = ttk.Frame(body3)
@@ -363,7 +389,7 @@ class MainWindow:
         self._attack_maps_container.bind("<Configure>", _on_attack_maps_frame_configure)
         self._attack_maps_canvas.bind("<Configure>", _on_attack_maps_canvas_configure)
         self._attack_maps_canvas.bind("<MouseWheel>", lambda e: self._attack_maps_canvas.yview_scroll(int(-1 * (e.delta / 120)), "units"))
-        ttk.Label(self._attack_maps_container, text="Wpisz nazwę i „Szukaj map” – klik w mapę: idź i atakuj.").pack(anchor=tk.W)
+        ttk.Label(self._attack_maps_container, text="Wpisz nazwę i „Szukaj map” (albo poziomy i „Szukaj łowisk”) – klik w mapę: idź i atakuj.").pack(anchor=tk.W)
         self._debug_accordion_sections.append((btn3, body3))
 
         # --- 4. Rozmawiaj z NPC ---
@@ -403,6 +429,7 @@ class MainWindow:
         row_btn = ttk.Frame(body5)
         row_btn.pack(anchor=tk.W)
         ttk.Button(row_btn, text="Idź na mapę", command=self._debug_navigate_to_map).pack(side=tk.LEFT, padx=(0, 8))
+        ttk.Button(row_btn, text="Raport grafu", command=self._debug_graph_report).pack(side=tk.LEFT, padx=(0, 8))
         self._debug_filter_maps()
         self._debug_accordion_sections.append((btn5, body5))
 
@@ -571,6 +598,61 @@ class MainWindow:
             self.root.after(0, lambda: self._fill_attack_maps(current_norm, groups, name))
         threading.Thread(target=work, daemon=True).start()
 
+    def _debug_attack_search_grounds(self):
+        """Łowiska dla zakresu poziomów (puste pola – poziom bohatera ±HUNT_LEVEL_SPAN), wg gęstości i czasu dojścia."""
+        def parse(var):
+            try:
+                return int((var.get() or "").strip())
+            except ValueError:
+                return None
+        lvl_min = parse(self._debug_hunt_lvl_min_var)
+        lvl_max = parse(self._debug_hunt_lvl_max_var)
+        driver = get_driver()
+        if not driver:
+            messagebox.showwarning("Uwaga", "Najpierw uruchom przeglądarkę i wejdź do gry.", parent=self.root)
+            return
+        self._log_append("Szukam łowisk...")
+        def work():
+            api = MargonemAPI(driver, log_callback=lambda m: self.root.after(0, lambda msg=m: self._log_append(msg)))
+            if not api.ensure_context():
+                self.root.after(0, lambda: self._log_append("Engine niedostępny – wejdź na postać."))
+                return
+            lo, hi = lvl_min, lvl_max
+            if lo is None or hi is None:
+                lvl = api.get_hero_stats().get("lvl")
+                if lvl is None:
+                    self.root.after(0, lambda: self._log_append("Debug: Podaj zakres poziomów."))
+                    return
+                lo = lo if lo is not None else max(1, int(lvl) - HUNT_LEVEL_SPAN)
+                hi = hi if hi is not None else int(lvl) + HUNT_LEVEL_SPAN
+            api.learn_map_geometry()
+            current_id = api.get_current_map_id()
+            current_norm = str(current_id) if current_id is not None else None
+            grounds = find_hunting_grounds(lo, hi, current_norm, start_pos=api.get_hero_position())
+            self.root.after(0, lambda: self._log_append("Łowiska dla poziomów {}–{}: {}.".format(lo, hi, len(grounds))))
+            self.root.after(0, lambda: self._fill_hunting_grounds(current_norm, grounds))
+        threading.Thread(target=work, daemon=True).start()
+
+    def _fill_hunting_grounds(self, current_map_id, grounds):
+        """Wypełnia kontener przyciskami łowisk (od najlepszego); klik – idź i atakuj najliczniejszego."""
+        for w in self._attack_maps_container.winfo_children():
+            w.destroy()
+        if not grounds:
+            ttk.Label(self._attack_maps_container, text="Brak osiągalnych map z potworami w tym zakresie.").pack(anchor=tk.W)
+            return
+        for map_id, map_name, count, travel_sec, top_name in grounds:
+            where = "TU JESTEŚ" if str(map_id) == current_map_id else (
+                "~{:.0f} s".format(travel_sec) if travel_sec is not None else "?"
+            )
+            btn = ttk.Button(
+                self._attack_maps_container,
+                text="{} – {} potw., {} ({})".format(map_name, count, top_name, where),
+                command=lambda mid=map_id, mname=map_name, ename=top_name: self._debug_attack_go_to_map(mid, mname, ename),
+            )
+            btn.pack(anchor=tk.W, pady=2)
+        self._attack_maps_canvas.update_idletasks()
+        self._attack_maps_canvas.configure(scrollregion=self._attack_maps_canvas.bbox("all"))
+
     def _fill_attack_maps(self, current_map_id, groups, enemy_name):
         """Wypełnia kontener przyciskami map pogrupowanymi wg odległości."""
         for w in self._attack_maps_container.winfo_children():
@@ -628,7 +710,8 @@ class MainWindow:
         self.root.after(0, self._process_refresh_listbox)
 
     def _process_on_finished(self, process_id):
-        """Wywołane gdy wątek procesu się kończy."""
+        """Wywołane gdy wątek procesu się kończy (zapisuje też zebrane czasy przejść)."""
+        flush_travel_times()
         if process_id == self._current_process_id:
             self._current_process_id = None
         if process_id in self._processes:
@@ -636,8 +719,49 @@ class MainWindow:
         self.root.after(0, self._process_refresh_listbox)
         self._process_worker_pick_next()
 
+    def _process_plan_queue(self, start_map_id, start_pos=None):
+        """
+        Ustala kolejność kolejki (TourPlanner: najbliższy sąsiad + 2-opt po szacowanych czasach)
+        od mapy start_map_id. Zwraca listę (process_id w kolejności trasy, łączny czas s);
+        procesy bez trasy – na końcu, w dotychczasowej kolejności.
+        """
+        queue = [pid for pid in list(self._process_queue) if pid in self._processes]
+        targets = [self._processes[pid].get("target_map_id") for pid in queue]
+        order, unreachable, total = self._tour.plan(start_map_id, targets, start_pos=start_pos)
+        return [queue[k] for k in order], [queue[k] for k in unreachable], total
+
+    def _process_apply_order(self, ordered):
+        """Ustawia kolejkę w kolejności ordered; procesy dodane w międzyczasie zostają na końcu."""
+        queue = list(self._process_queue)
+        self._process_queue[:] = [pid for pid in ordered if pid in queue] + [pid for pid in queue if pid not in ordered]
+        self._process_refresh_listbox()
+
+    def _process_replan(self):
+        """
+        Przelicza kolejność kolejki po dodaniu / usunięciu procesu lub „Wykonaj teraz”.
+        Trasa zaczyna się na mapie docelowej bieżącego procesu (tam bohater skończy) albo na obecnej mapie.
+        """
+        if len(self._process_queue) < 2:
+            return
+        current = self._processes.get(self._current_process_id) if self._current_process_id else None
+        start_map_id = current.get("target_map_id") if current else None
+        def work():
+            start, pos = start_map_id, None
+            if start is None:
+                driver = get_driver()
+                if not driver:
+                    return
+                api = MargonemAPI(driver)
+                if not api.ensure_context():
+                    return
+                start, pos = api.get_current_map_id(), api.get_hero_position()
+            ordered, unreachable, total = self._process_plan_queue(start, pos)
+            self.root.after(0, lambda: self._process_apply_order(ordered + unreachable))
+            self.root.after(0, lambda: self._log_append("Kolejka: trasa przez {} map, ~{:.0f} s.".format(len(ordered), total)))
+        threading.Thread(target=work, daemon=True).start()
+
     def _process_worker_pick_next(self):
-        """Wybiera z kolejki proces z najbliższą mapą i uruchamia go."""
+        """Układa kolejkę w najkrótszą trasę (TourPlanner) i uruchamia pierwszy proces."""
         if self._current_process_id is not None or not self._process_queue:
             self.root.after(0, self._process_refresh_listbox)
             return
@@ -651,22 +775,20 @@ class MainWindow:
                 self.root.after(0, self._process_refresh_listbox)
                 return
             current_map_id = api.get_current_map_id()
-            best_pid, best_dist = None, 9999
-            for pid in self._process_queue:
-                if pid not in self._processes:
-                    continue
-                tid = self._processes[pid].get("target_map_id")
-                path = bfs_path(current_map_id, tid) if tid else None
-                d = len(path) if path is not None else 9999
-                if d < best_dist:
-                    best_dist = d
-                    best_pid = pid
-            if best_pid is None:
+            hero_pos = api.get_hero_position()
+            api.learn_map_geometry()
+            # Cała kolejka jako jedna trasa (szacowane czasy dojść), nie zachłannie najbliższa mapa
+            ordered, unreachable, total = self._process_plan_queue(current_map_id, hero_pos)
+            if not ordered:
                 self.root.after(0, self._process_refresh_listbox)
                 return
-            self._process_queue.remove(best_pid)
+            best_pid = ordered[0]
+            if best_pid in self._process_queue:
+                self._process_queue.remove(best_pid)
             self._current_process_id = best_pid
-            self.root.after(0, self._process_refresh_listbox)
+            self.root.after(0, lambda: self._process_apply_order(ordered[1:] + unreachable))
+            if len(ordered) > 1:
+                self.root.after(0, lambda: self._log_append("Kolejka: trasa przez {} map, ~{:.0f} s.".format(len(ordered), total)))
             self._run_attack_process(best_pid)
         threading.Thread(target=pick_and_run, daemon=True).start()
 
@@ -704,11 +826,10 @@ class MainWindow:
                     return
                 current_id = api.get_current_map_id()
                 if current_id is not None and str(current_id) != str(target_map_id):
-                    path = bfs_path(current_id, target_map_id)
-                    if path is None:
+                    if not is_reachable(current_id, target_map_id):
                         self.root.after(0, lambda: self._log_append("Brak ścieżki do mapy {}.".format(target_map_name)))
                         return
-                    ok = api.navigate_to_map(path)
+                    ok = api.travel_to_map(target_map_id)
                     self.root.after(0, lambda: self._log_append("Dojście na mapę (sukces={}).".format(ok)))
                     if not ok:
                         return
@@ -717,11 +838,7 @@ class MainWindow:
                     if cancel_ev.is_set():
                         log("Atak anulowany.")
                         break
-                    while pause_ev.is_set():
-                        time.sleep(0.3)
-                        if cancel_ev.is_set():
-                            break
-                    if cancel_ev.is_set():
+                    if not wait_while_paused(pause_ev.is_set, cancel_ev.is_set):
                         break
                     log("Atakuję najbliższego '{}'...".format(enemy_name))
                     ok = api.attack_entity_by_name(enemy_name, timeout_sec=45)
@@ -752,11 +869,9 @@ class MainWindow:
         while True:
             if cancel_ev.is_set():
                 return False
-            while pause_ev.is_set():
-                time.sleep(0.3)
-                if cancel_ev.is_set():
-                    return False
-            if api.find_npcs_by_name(enemy_name):
+            if not wait_while_paused(pause_ev.is_set, cancel_ev.is_set):
+                return False
+            if api.find_npcs_by_name(enemy_name, live=True):
                 return True
             maps_with_mob = get_maps_with_npc(enemy_name)
             current_id = api.get_current_map_id()
@@ -789,7 +904,7 @@ class MainWindow:
             if cancel_ev.is_set():
                 return False
             last_visited_map_id = current_id
-            if api.find_npcs_by_name(enemy_name):
+            if api.find_npcs_by_name(enemy_name, live=True):
                 return True
             log("Na mapie {} brak mobków – chodzę 15 s, potem spróbuję innej sąsiedniej.".format(next_map_name))
             api.wander_randomly_for_seconds(
@@ -815,6 +930,7 @@ class MainWindow:
             self._process_queue.remove(pid)
         self._current_process_id = pid
         self._process_refresh_listbox()
+        self._process_replan()
         self._run_attack_process(pid)
 
     def _process_pause_toggle(self):
@@ -837,12 +953,13 @@ class MainWindow:
             self._process_queue.remove(pid)
             self._process_remove(pid)
             self._log_append("Usunięto z kolejki.")
+            self._process_replan()
         else:
             self._processes[pid]["cancel"].set()
             self._log_append("Anulowano (zakończy się przy najbliższej okazji).")
 
     def _debug_attack_go_to_map(self, target_map_id, target_map_name, enemy_name):
-        """Dodaje atak do kolejki procesów (najbliższa mapa wykonywana pierwsza)."""
+        """Dodaje atak do kolejki procesów (kolejność – najkrótsza łączna trasa przez mapy kolejki)."""
         driver = get_driver()
         if not driver:
             messagebox.showwarning("Uwaga", "Najpierw uruchom przeglądarkę i wejdź do gry.", parent=self.root)
@@ -866,6 +983,8 @@ class MainWindow:
         self._process_queue.append(process_id)
         self._process_refresh_listbox()
         self._log_append("Dodano do kolejki: {}.".format(display_name))
+        if self._current_process_id is not None:
+            self._process_replan()
         self._process_worker_pick_next()
 
     def _debug_talk_by_name(self):
@@ -906,8 +1025,7 @@ class MainWindow:
                 if not api.ensure_context():
                     self.root.after(0, lambda: self._log_append("Debug: Engine niedostępny – wejdź na postać."))
                     return
-                while pause_ev.is_set() and not cancel_ev.is_set():
-                    time.sleep(0.3)
+                wait_while_paused(pause_ev.is_set, cancel_ev.is_set)
                 if cancel_ev.is_set():
                     return
                 current_id = api.get_current_map_id()
@@ -918,21 +1036,24 @@ class MainWindow:
                     api.talk_to_entity_by_name(name, timeout_sec=45)
                     self.root.after(0, lambda: self._log_append("--- Koniec rozmowy ---"))
                     return
-                best_map_id, best_name, _ = None, None, None
-                best_len = 9999
+                best_map_id, best_name = None, None
+                best_cost = float("inf")
+                hero_pos = api.get_hero_position()
+                api.learn_map_geometry()
+                # jedno przeszukanie od bieżącej mapy – czasy dojścia do wszystkich kandydatów naraz
+                travel = travel_times_from(current_norm, start_pos=hero_pos) if current_norm is not None else {}
                 for map_id, map_name, _ in maps_with_npc:
-                    path = bfs_path(current_id, map_id)
-                    if path is not None and len(path) < best_len:
-                        best_len = len(path)
+                    cost = travel.get(str(map_id))
+                    if cost is not None and cost < best_cost:
+                        best_cost = cost
                         best_map_id, best_name = map_id, map_name
                 if best_map_id is None:
                     self.root.after(0, lambda: self._log_append("Brak ścieżki do żadnej mapy z tym NPC."))
                     return
-                log("Idę na mapę {} ({} przejść), potem rozmowa.".format(best_name, best_len))
-                path = bfs_path(current_id, best_map_id)
+                log("Idę na mapę {} (~{:.0f} s), potem rozmowa.".format(best_name, best_cost))
                 if cancel_ev.is_set():
                     return
-                if not api.navigate_to_map(path):
+                if not api.travel_to_map(best_map_id):
                     self.root.after(0, lambda: self._log_append("--- Nie udało się dojść na mapę ---"))
                     return
                 if cancel_ev.is_set():
@@ -980,21 +1101,60 @@ class MainWindow:
             if current_id is None:
                 self.root.after(0, lambda: self._log_append("Debug: Nie odczytano obecnej mapy."))
                 return
-            path = bfs_path(current_id, target_map_id)
+            hero_pos = api.get_hero_position()
+            api.learn_map_geometry()
+            path = plan_route(current_id, target_map_id, start_pos=hero_pos)
             if path is None:
-                self.root.after(0, lambda: self._log_append("Brak ścieżki BFS z mapy {} do {}.".format(
+                self.root.after(0, lambda: self._log_append("Brak ścieżki z mapy {} do {}.".format(
                     get_map_name_by_id(current_id) or current_id, target_name)))
                 return
             if not path:
                 self.root.after(0, lambda: self._log_append("Już jesteś na mapie {}.".format(target_name)))
                 return
-            self.root.after(0, lambda: self._log_append("Ścieżka ({} kroków): {} -> ... -> {}.".format(
-                len(path), get_map_name_by_id(current_id) or current_id, target_name)))
-            ok = api.navigate_to_map(path)
+            cost = estimate_route_sec(current_id, path, start_pos=hero_pos)
+            self.root.after(0, lambda: self._log_append("Ścieżka ({} kroków, ~{:.0f} s): {} -> ... -> {}.".format(
+                len(path), cost, get_map_name_by_id(current_id) or current_id, target_name)))
+            ok = api.travel_to_map(target_map_id)
             self.root.after(0, lambda: self._log_append("--- Koniec nawigacji (sukces={}) ---".format(ok)))
 
         threading.Thread(target=work, daemon=True).start()
 
+    def _debug_graph_report(self):
+        """Wypisuje spójność grafu map: składowe, wyjścia jednokierunkowe, mapy izolowane."""
+        def work():
+            # pierwsze wywołanie wczytuje graf (JSON, składowe) – poza wątkiem GUI
+            r = graph_report()
+            lines = ["--- Graf map: {} map, {} składowych (największa: {} map) ---".format(
+                r["maps"], r["components"], r["largest_component"])]
+            one_way = r["one_way_exits"]
+            lines.append("Wyjścia jednokierunkowe: {}.".format(len(one_way)))
+            for mid, _gw, tid in one_way[:30]:
+                lines.append("  {} -> {}".format(get_map_name_by_id(mid) or mid, get_map_name_by_id(tid) or tid))
+            if len(one_way) > 30:
+                lines.append("  ... i {} więcej.".format(len(one_way) - 30))
+            isolated = r["isolated_maps"]
+            lines.append("Mapy izolowane (bez przejść): {}.".format(len(isolated)))
+            for mid in isolated[:30]:
+                lines.append("  {} (ID: {})".format(get_map_name_by_id(mid) or mid, mid))
+            if len(isolated) > 30:
+                lines.append("  ... i {} więcej.".format(len(isolated) - 30))
+            collisions = r["name_collisions"]
+            lines.append("Nazwy noszone przez kilka map: {}.".format(len(collisions)))
+            for name, mids in collisions[:30]:
+                lines.append("  {}: {}".format(name, ", ".join(mids)))
+            if len(collisions) > 30:
+                lines.append("  ... i {} więcej.".format(len(collisions) - 30))
+            ov = r["overlay"]
+            lines.append("Poprawki z gry (nakładka): {} map, dodane przejścia: {}, martwe: {}.".format(
+                ov["maps"], ov["added"], ov["dead"]))
+            lines.append("---")
+
+            def show():
+                for line in lines:
+                    self._log_append(line)
+            self.root.after(0, show)
+        threading.Thread(target=work, daemon=True).start()
+
     def _debug_list_npcs(self):
         driver = get_driver()
         if not driver:
@@ -1016,6 +1176,8 @@ class MainWindow:
         self._btn_run.config(state=tk.DISABLED)
         self._status.config(text="Uruchamiam przeglądarkę...")
         self._log_append("Uruchamiam przeglądarkę (Chrome)...")
+        # Graf map wczytuje się w tle, zanim przeglądarka i logowanie się skończą
+        warm_up_maps()
 
         def work():
             try:
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Agent w stronie gry – mały skrypt JS wstrzykiwany raz na załadowanie strony.
+Przy każdym odczycie porównuje stan Engine (NPC, bohater, blokady, zmiana mapy) z poprzednim
+i odkłada różnice do kolejki zdarzeń w oknie gry. Strona Pythona pobiera tylko zdarzenia od
+ostatniego odczytu (delty), zamiast serializować całą listę NPC przy każdym sprawdzeniu.
+Agent nie działa w tle – bez odczytów nie obciąża strony.
+Użycie: agent = PageAgent(api); agent.sync(); agent.npcs()
+"""
+from page_scripts import register_script
+
+# Kolejka jest pierścieniem (MAX zdarzeń) i nie jest czyszczona przy odczycie – kilku
+# konsumentów (osobne instancje PageAgent) może czytać niezależnie, każdy od swojego seq.
+# Gdy konsument zostanie w tyle albo strona się przeładuje, dostaje pełny stan (full).
+AGENT_JS = """
+(function () {
+    if (window.__mbotAgent) {
+        // agent z wcześniejszej wersji odpytywał Engine timerem – wyłączamy go
+        if (window.__mbotAgent.timer) clearInterval(window.__mbotAgent.timer);
+        window.__mbotAgent.timer = null;
+        return;
+    }
+    var MAX = 2000;
+    var a = {
+        id: String(Date.now()) + '-' + Math.random().toString(36).slice(2),
+        seq: 0, base: 1, events: [], state: null
+    };
+    function readState() {
+        var s = { map: null, hero: null, locks: {}, npcs: {} };
+        if (typeof Engine === 'undefined' || !Engine) return s;
+        if (Engine.map && Engine.map.d) s.map = Engine.map.d.id;
+        if (Engine.hero && Engine.hero.d) s.hero = { x: Engine.hero.d.x, y: Engine.hero.d.y };
+        if (Engine.lock) s.locks = {
+            battle: !!Engine.lock.check('battle'),
+            npcdialog: !!Engine.lock.check('npcdialog')
+        };
+        var npcs = Engine.npcs ? Engine.npcs.check() : {};
+        for (var id in npcs) {
+            var n = npcs[id];
+            if (n && n.d) s.npcs[n.d.id] = { id: n.d.id, x: n.d.x, y: n.d.y, nick: (n.d.nick || '') };
+        }
+        return s;
+    }
+    function push(ev) {
+        ev.seq = ++a.seq;
+        ev.t = Date.now();
+        a.events.push(ev);
+        if (a.events.length > MAX) a.events.shift();
+        a.base = a.events[0].seq;
+    }
+    function tick() {
+        var s;
+        try { s = readState(); } catch (e) { return; }
+        var p = a.state;
+        a.state = s;
+        if (!p) return;
+        if (s.map !== p.map) push({ type: 'map', id: s.map });
+        if (s.hero && (!p.hero || s.hero.x !== p.hero.x || s.hero.y !== p.hero.y)) {
+            push({ type: 'hero', x: s.hero.x, y: s.hero.y });
+        }
+        for (var k in s.locks) {
+            if (s.locks[k] !== p.locks[k]) push({ type: 'lock', name: k, value: s.locks[k] });
+        }
+        for (var id in s.npcs) {
+            var n = s.npcs[id], o = p.npcs[id];
+            if (!o) push({ type: 'npc_add', npc: n });
+            else if (o.x !== n.x || o.y !== n.y || o.nick !== n.nick) push({ type: 'npc_move', npc: n });
+        }
+        for (var id2 in p.npcs) {
+            if (!s.npcs[id2]) push({ type: 'npc_del', id: p.npcs[id2].id });
+        }
+    }
+    a.full = function () {
+        tick();
+        var s = a.state || readState(), list = [];
+        for (var id in s.npcs) list.push(s.npcs[id]);
+        return { map: s.map, hero: s.hero, locks: s.locks, npcs: list };
+    };
+    a.drain = function (since, agentId) {
+        tick();
+        if (agentId !== a.id || since < a.base - 1) return { id: a.id, seq: a.seq, full: a.full() };
+        var out = [];
+        for (var i = 0; i < a.events.length; i++) {
+            if (a.events[i].seq > since) out.push(a.events[i]);
+        }
+        return { id: a.id, seq: a.seq, events: out };
+    };
+    window.__mbotAgent = a;
+})();
+"""
+
+# Pomocnik z page_scripts: instaluje agenta przy pierwszym odczycie po załadowaniu strony.
+register_script(
+    "agentDrain",
+    "function (since, agentId) {\n" + AGENT_JS + "\nreturn window.__mbotAgent.drain(since, agentId);\n}",
+)
+
+
+class PageAgent:
+    """
+    Lustro stanu gry po stronie Pythona, aktualizowane deltami z agenta w stronie.
+    api – MargonemAPI (wywołania idą przez api._call, więc kontekst gry jest pilnowany).
+    """
+
+    def __init__(self, api):
+        self.api = api
+        self.agent_id = None  # id instancji agenta w stronie – zmienia się po przeładowaniu
+        self.seq = 0  # ostatnie przeczytane zdarzenie
+        self.map_id = None
+        self.hero = None  # (x, y)
+        self.locks = {}
+        self._npcs = {}  # str(id) -> {id, x, y, nick}
+        self.resyncs = 0  # ile razy agent zwrócił pełny stan zamiast delt
+
+    def sync(self):
+        """
+        Pobiera zdarzenia od ostatniego odczytu i nakłada je na lustro.
+        Agent jest instalowany przy pierwszym odczycie w danej stronie (np. po przeładowaniu).
+        Zwraca listę zdarzeń (przy pełnej resynchronizacji – pustą) lub None przy błędzie.
+        """
+        try:
+            res = self.api._call("agentDrain", self.seq, self.agent_id)
+        except Exception:
+            return None
+        if not isinstance(res, dict):
+            return None
+        self.agent_id = res.get("id")
+        self.seq = res.get("seq") or 0
+        if "full" in res:
+            self._apply_full(res.get("full") or {})
+            return []
+        events = res.get("events") or []
+        for ev in events:
+            self._apply_event(ev)
+        return events
+
+    def _apply_full(self, full):
+        self.resyncs += 1
+        self.map_id = full.get("map")
+        hero = full.get("hero")
+        self.hero = (hero["x"], hero["y"]) if hero else None
+        self.locks = dict(full.get("locks") or {})
+        self._npcs = {}
+        for n in full.get("npcs") or []:
+            self._npcs[str(n.get("id"))] = n
+
+    def _apply_event(self, ev):
+        kind = ev.get("type")
+        if kind in ("npc_add", "npc_move"):
+            n = ev.get("npc") or {}
+            self._npcs[str(n.get("id"))] = n
+        elif kind == "npc_del":
+            self._npcs.pop(str(ev.get("id")), None)
+        elif kind == "hero":
+            self.hero = (ev.get("x"), ev.get("y"))
+        elif kind == "lock":
+            self.locks[ev.get("name")] = ev.get("value")
+        elif kind == "map":
+            self.map_id = ev.get("id")
+
+    def npcs(self):
+        """Lista NPC z lustra: [{id, x, y, nick}, ...]."""
+        return list(self._npcs.values())
+
+    def get_npc(self, npc_id):
+        """NPC o danym ID z lustra lub None."""
+        return self._npcs.get(str(npc_id))
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Rejestr skryptów pomocniczych instalowanych w stronie gry.
+Duże ciała JS są wysyłane do przeglądarki raz na załadowanie strony i trzymane jako funkcje
+w window.__mbot.fn; kolejne wywołania wysyłają tylko nazwę funkcji i argumenty.
+Po przeładowaniu strony (lub zmianie kodu pomocników) wywołanie zwraca znacznik
+braku i MargonemAPI instaluje pomocników ponownie.
+Użycie: register_script("nazwa", "function (a, b) { ... }"); api._call("nazwa", a, b)
+"""
+import hashlib
+import json
+import threading
+
+NAMESPACE = "__mbot"
+MISSING_KEY = "__mbot_missing"
+
+_scripts = {}  # nazwa -> źródło funkcji JS
+_version = None
+_lock = threading.Lock()
+
+CALL_JS = (
+    "var m = window." + NAMESPACE + ", name = arguments[1];"
+    " if (!m || m.v !== arguments[0] || !m.fn[name]) return { " + MISSING_KEY + ": true };"
+    " return m.fn[name].apply(null, arguments[2]);"
+)
+
+CALL_ASYNC_JS = (
+    "var m = window." + NAMESPACE + ", name = arguments[1], done = arguments[arguments.length - 1];"
+    " if (!m || m.v !== arguments[0] || !m.fn[name]) return done({ " + MISSING_KEY + ": true });"
+    " m.fn[name].apply(null, arguments[2].concat([done]));"
+)
+
+
+def register_script(name, source):
+    """
+    Rejestruje funkcję JS pod nazwą name. source to wyrażenie funkcji, np. "function (id) { ... }".
+    Funkcje asynchroniczne (wywoływane przez _call_async) dostają callback jako ostatni argument.
+    """
+    global _version
+    with _lock:
+        _scripts[name] = source
+        _version = None
+
+
+def scripts_version():
+    """Skrót wszystkich zarejestrowanych źródeł – zmienia się, gdy zmieni się którykolwiek pomocnik."""
+    global _version
+    with _lock:
+        if _version is None:
+            h = hashlib.sha1()
+            for name in sorted(_scripts):
+                h.update(name.encode("utf-8"))
+                h.update(_scripts[name].encode("utf-8"))
+            _version = h.hexdigest()[:12]
+        return _version
+
+
+def install_source():
+    """Skrypt definiujący window.__mbot = {v, fn: {...}} ze wszystkimi zarejestrowanymi funkcjami."""
+    version = scripts_version()
+    with _lock:
+        body = ",\n".join(
+            "{}: {}".format(json.dumps(name), source) for name, source in sorted(_scripts.items())
+        )
+    return "window.{} = {{ v: {}, fn: {{\n{}\n}} }};".format(NAMESPACE, json.dumps(version), body)
+
+
+def is_missing(result):
+    """Czy wynik wywołania to znacznik braku pomocników w stronie."""
+    return isinstance(result, dict) and bool(result.get(MISSING_KEY))
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Wspólna polityka odpytywania dla pętli oczekiwania (wait_*, chodzenie, pauzy).
+Zamiast stałych odstępów (0.3 / 0.4 / 0.5 s) każda pętla dostaje PollingPolicy:
+– gdy nic się nie zmienia, odstęp rośnie (backoff) do max_interval,
+– gdy coś się zmieniło, wraca do min_interval,
+– przy spodziewanym zdarzeniu (ETA dojścia, koniec walki) zagęszcza sprawdzenia wokół ETA,
+– nigdy nie przekracza budżetu wywołań WebDrivera na sekundę (CallBudget, wspólny per driver).
+Użycie:
+    policy = api.polling_policy()
+    policy.expect(eta_sec)
+    while ...:
+        changed = ...
+        policy.sleep(changed, deadline=deadline)
+"""
+import threading
+import time
+import weakref
+
+# Domyślne granice odstępu między sprawdzeniami (s) i mnożnik backoffu.
+POLL_MIN_INTERVAL_SEC = 0.1
+POLL_MAX_INTERVAL_SEC = 1.0
+POLL_BACKOFF = 1.5
+
+# Po minięciu ETA przez tyle sekund sprawdzamy jeszcze co min_interval, potem wraca backoff.
+POLL_ETA_GRACE_SEC = 1.0
+
+# Globalny (per driver) budżet wywołań execute_script / execute_async_script na sekundę.
+# BURST – ile wywołań można wykonać naraz ponad średnią (np. akcja + migawka).
+CALLS_PER_SEC = 8.0
+CALLS_BURST = 8.0
+
+# Odstęp sprawdzania flagi pauzy – bez wywołań WebDrivera, więc poza budżetem.
+PAUSE_POLL_SEC = 0.3
+
+
+class CallBudget:
+    """
+    Kubełek żetonów dla wywołań WebDrivera jednego drivera.
+    Akcje nie czekają (note_call tylko zapisuje dług), natomiast pętle odpytujące pytają
+    wait_time() i odsypiają tyle, ile trzeba, by średnia nie przekroczyła rate wywołań/s.
+    """
+
+    def __init__(self, rate=CALLS_PER_SEC, burst=CALLS_BURST):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._last = time.time()
+        self.calls = 0
+        self.throttled = 0  # ile razy polityka wydłużyła odstęp z powodu budżetu
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def note_call(self):
+        """Zapisuje jedno wywołanie WebDrivera (żeton może zejść poniżej zera – dług)."""
+        with self.lock:
+            self._refill(time.time())
+            # dług ograniczony do jednej sekundy budżetu – po serii akcji nie blokujemy pętli na długo
+            self._tokens = max(-self.rate, self._tokens - 1.0)
+            self.calls += 1
+
+    def wait_time(self):
+        """Ile sekund poczekać, by następne wywołanie mieściło się w budżecie (0 gdy od razu)."""
+        with self.lock:
+            self._refill(time.time())
+            if self._tokens >= 1.0:
+                return 0.0
+            return (1.0 - self._tokens) / self.rate
+
+    def stats(self):
+        return {"rate": self.rate, "calls": self.calls, "throttled": self.throttled}
+
+
+_budgets = weakref.WeakKeyDictionary()
+_budgets_lock = threading.Lock()
+
+
+def get_call_budget(driver):
+    """Wspólny (dla wszystkich instancji MargonemAPI i wątków) budżet wywołań danego drivera."""
+    with _budgets_lock:
+        budget = _budgets.get(driver)
+        if budget is None:
+            budget = CallBudget()
+            _budgets[driver] = budget
+        return budget
+
+
+class PollingPolicy:
+    """
+    Odstęp między kolejnymi sprawdzeniami w jednej pętli oczekiwania.
+    observe(changed) – True resetuje odstęp do min_interval, False mnoży go przez backoff;
+    expect(eta_sec) – zdarzenie spodziewane za eta_sec: do ETA śpimy najwyżej połowę
+    pozostałego czasu, tuż po ETA (grace) – min_interval.
+    """
+
+    def __init__(
+        self,
+        budget=None,
+        min_interval=POLL_MIN_INTERVAL_SEC,
+        max_interval=POLL_MAX_INTERVAL_SEC,
+        backoff=POLL_BACKOFF,
+        eta_grace=POLL_ETA_GRACE_SEC,
+    ):
+        self.budget = budget
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = backoff
+        self.eta_grace = eta_grace
+        self._interval = min_interval
+        self._eta = None  # time.time() spodziewanego zdarzenia
+        self.polls = 0
+
+    def reset(self):
+        """Wraca do min_interval i zapomina ETA (np. nowy cel ruchu)."""
+        self._interval = self.min_interval
+        self._eta = None
+
+    def expect(self, eta_sec):
+        """Zdarzenie spodziewane za eta_sec sekund (None – brak oczekiwanego zdarzenia)."""
+        self._eta = None if eta_sec is None else time.time() + max(0.0, eta_sec)
+
+    def observe(self, changed):
+        """Wynik ostatniego sprawdzenia: czy stan się zmienił."""
+        if changed:
+            self._interval = self.min_interval
+        else:
+            self._interval = min(self.max_interval, self._interval * self.backoff)
+
+    def next_interval(self):
+        """Odstęp do następnego sprawdzenia (s), z uwzględnieniem ETA i budżetu wywołań."""
+        interval = self._interval
+        if self._eta is not None:
+            until = self._eta - time.time()
+            if until > 0:
+                interval = min(interval, max(self.min_interval, until / 2.0))
+            elif -until <= self.eta_grace:
+                interval = self.min_interval
+        if self.budget is not None:
+            wait = self.budget.wait_time()
+            if wait > interval:
+                with self.budget.lock:
+                    self.budget.throttled += 1
+                interval = wait
+        return interval
+
+    def sleep(self, changed=None, deadline=None):
+        """
+        observe(changed) (gdy podane) i sen do następnego sprawdzenia, najdłużej do deadline.
+        Zwraca faktyczny czas snu.
+        """
+        if changed is not None:
+            self.observe(changed)
+        interval = self.next_interval()
+        if deadline is not None:
+            interval = min(interval, max(0.0, deadline - time.time()))
+        self.polls += 1
+        if interval > 0:
+            time.sleep(interval)
+        return interval
+
+
+def wait_while_paused(pause_check, cancel_check=None):
+    """
+    Czeka, dopóki pause_check() zwraca True. Zwraca False gdy w trakcie anulowano (cancel_check()),
+    inaczej True.
+    """
+    while pause_check and pause_check():
+        time.sleep(PAUSE_POLL_SEC)
+        if cancel_check and cancel_check():
+            return False
+    return True
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Zmierzone czasy przejść przez mapy, zapisywane w katalogu AppData (travel_times.json).
+Klucz: (mapa, brama wejściowa, brama wyjściowa) – czas od rozpoczęcia marszu do bramy
+do udanej zmiany mapy. Kolejne pomiary są uśredniane wykładniczo (EWMA), więc stare
+pomiary z czasem tracą wagę. maps_graph.plan_route używa ich zamiast szacunków z geometrii.
+Plik zapisywany zbiorczo (co TRAVEL_FLUSH_SEC, flush_travel_times() i przy wyjściu z procesu).
+"""
+import time
+
+from appdata_store import AppDataStore
+
+TRAVEL_TIMES_FILENAME = "travel_times.json"
+
+# Waga nowego pomiaru w średniej wykładniczej.
+EWMA_ALPHA = 0.3
+
+# Pomiary dłuższe (s) są pomijane – to zwykle zablokowanie, zagadka albo pauza, nie droga.
+MAX_SAMPLE_SEC = 180.0
+
+# Pomiary zapisywane zbiorczo najpóźniej po tylu sekundach (a nie po każdym przejściu).
+TRAVEL_FLUSH_SEC = 30.0
+
+# "mapa|wejście|wyjście" -> {"sec": float, "n": int, "t": time}
+_store = AppDataStore(TRAVEL_TIMES_FILENAME, "legs")
+_generation = 0  # rośnie przy każdym zapisanym pomiarze (unieważnianie planów w maps_graph)
+
+
+def _key(map_id, entry_gateway_id, exit_gateway_id):
+    return "{}|{}|{}".format(map_id, "" if entry_gateway_id is None else entry_gateway_id, exit_gateway_id)
+
+
+def record_travel(map_id, entry_gateway_id, exit_gateway_id, seconds):
+    """
+    Zapisuje pomiar: przejście mapy map_id od bramy entry_gateway_id (None – nieznana) do wyjścia
+    bramą exit_gateway_id zajęło seconds. Zwraca nową średnią albo None gdy pomiar odrzucono.
+    """
+    if map_id is None or exit_gateway_id is None or seconds is None:
+        return None
+    global _generation
+    if seconds <= 0 or seconds > MAX_SAMPLE_SEC:
+        return None
+    with _store.lock:
+        legs = _store.data()
+        key = _key(map_id, entry_gateway_id, exit_gateway_id)
+        leg = legs.get(key)
+        if leg is None:
+            leg = {"sec": float(seconds), "n": 1}
+        else:
+            leg = {
+                "sec": (1.0 - EWMA_ALPHA) * float(leg.get("sec") or seconds) + EWMA_ALPHA * float(seconds),
+                "n": int(leg.get("n") or 0) + 1,
+            }
+        leg["t"] = time.time()
+        legs[key] = leg
+        _generation += 1
+        _store.save_later(TRAVEL_FLUSH_SEC)
+        return leg["sec"]
+
+
+def flush_travel_times():
+    """Natychmiastowy zapis pomiarów czekających na zapis zbiorczy."""
+    _store.flush()
+
+
+def get_travel_sec(map_id, entry_gateway_id, exit_gateway_id):
+    """Wyuczony czas (s) przejścia mapy od bramy wejściowej do wyjściowej lub None gdy brak pomiarów."""
+    with _store.lock:
+        leg = _store.data().get(_key(map_id, entry_gateway_id, exit_gateway_id))
+    return leg.get("sec") if leg else None
+
+
+def travel_generation():
+    """Licznik zmian: inny niż poprzednio – od tamtej chwili doszły nowe pomiary."""
+    return _generation
+
+
+def learned_legs():
+    """
+    Kopia pomiarów do planowania tras: map_id -> {(brama wejściowa | None, brama wyjściowa): s}.
+    Jedno wzięcie blokady na cały plan zamiast get_travel_sec na każdej krawędzi.
+    """
+    out = {}
+    with _store.lock:
+        for key, leg in _store.data().items():
+            parts = key.split("|")
+            if len(parts) != 3 or not leg.get("sec"):
+                continue
+            out.setdefault(parts[0], {})[(parts[1] or None, parts[2])] = leg["sec"]
+    return out